@@ -15,6 +15,11 @@
 # limitations under the License.
 from dataclasses import dataclass, field
 
+# Prefixes of the names of the torchvision model families supported as `ACTConfig.vision_backbone`.
+VISION_BACKBONE_FAMILIES = ("resnet", "regnet", "mobilenet", "efficientnet")
+# Modules that support `ACTConfig.activation_checkpointing`.
+ACTIVATION_CHECKPOINTING_MODULES = ("backbone", "vae_encoder", "encoder", "decoder")
+
 
 @dataclass
 class ACTConfig:
@@ -58,31 +63,94 @@ class ACTConfig:
             [-1, 1] range.
         output_normalization_modes: Similar dictionary as `normalize_input_modes`, but to unnormalize to the
             original scale. Note that this is also used for normalizing the training targets.
-        vision_backbone: Name of the torchvision resnet backbone to use for encoding images.
-        pretrained_backbone_weights: Pretrained weights from torchvision to initalize the backbone.
-            `None` means no pretrained weights.
+        image_crops: Optional per-camera region of interest, as a `[top, left, height, width]` crop in pixels
+            of the camera's input image. Cameras that aren't listed aren't cropped.
+        image_resize_shapes: Optional per-camera `[height, width]` that the (cropped) images are resized to.
+            Downscaling cuts the vision backbone's cost and the number of image tokens in the transformer
+            encoder, e.g. from 15x20 to 8x10 per camera for 480x640 frames resized to 240x320. Cameras that
+            aren't listed aren't resized. The crops and resizes run in `ACTPolicy` before the vision backbone,
+            both in training and at inference, so the inputs stay at the cameras' resolution everywhere else.
+            All cameras must have the same shape after these transforms.
+        vision_backbone: Name of the torchvision backbone to use for encoding images. One of the ResNet,
+            RegNet, MobileNet or EfficientNet variants (e.g. "resnet18", "regnet_y_400mf",
+            "mobilenet_v3_large" or "efficientnet_b0"). The lighter ones are much cheaper on CPU, see
+            `benchmark_act.py vision-backbone`. The image features are taken from the final feature map.
+        pretrained_backbone_weights: Pretrained weights from torchvision to initalize the backbone. They must
+            match `vision_backbone` (e.g. "MobileNet_V3_Large_Weights.IMAGENET1K_V1" for
+            "mobilenet_v3_large"). `None` means no pretrained weights.
         replace_final_stride_with_dilation: Whether to replace the ResNet's final 2x2 stride with a dilated
-            convolution.
+            convolution. Only supported for the ResNet backbones.
+        freeze_backbone: Whether to freeze the vision backbone: its weights aren't trained and it always runs
+            in eval mode. This is required to train on precomputed backbone feature maps instead of the
+            camera images (see `lerobot.common.policies.act.feature_cache_act`).
+        batch_cameras_in_backbone: Whether to fold the camera axis into the batch axis so that all camera
+            views go through the vision backbone (and the image feature input projection) in a single call,
+            rather than one call per camera. The results match the per-camera path; this only affects speed.
+        image_token_reduction: How to reduce the number of image feature tokens fed to the transformer
+            encoder (one per backbone feature map cell and camera, so 2 x 15x20 for two 480x640 cameras),
+            which trades encoder (and decoder cross-attention) cost for accuracy. None keeps all the tokens.
+            "pool" average pools each camera's feature map with a stride of `image_token_pool_stride`, and
+            the tokens get the positional embeddings of the pooled grid. "topk" keeps the
+            `image_token_topk` tokens per camera with the highest scores from a learned linear scorer, along
+            with their positional embeddings. The kept tokens are scaled by the sigmoid of their score, so
+            that the scorer is trained through the loss.
+        image_token_pool_stride: Kernel size and stride of the "pool" image token reduction.
+        image_token_topk: Number of tokens kept per camera by the "topk" image token reduction.
         pre_norm: Whether to use "pre-norm" in the transformer blocks.
         dim_model: The transformer blocks' main hidden dimension.
         n_heads: The number of heads to use in the transformer blocks' multi-head attention.
         dim_feedforward: The dimension to expand the transformer's hidden dimension to in the feed-forward
             layers.
         feedforward_activation: The activation to use in the transformer block's feed-forward layers.
+        attention_backend: The multi-head attention implementation to use in the transformer layers. "mha" is
+            `nn.MultiheadAttention`. "sdpa" is `ACTAttention`, built on `F.scaled_dot_product_attention` with
+            fused input projections, which is faster and lighter on memory. Both have the same parameters, so
+            a checkpoint trained with one backend can be loaded with the other. Outputs match up to float
+            rounding.
         n_encoder_layers: The number of transformer layers to use for the transformer encoder.
         n_decoder_layers: The number of transformer layers to use for the transformer decoder.
+        decoder_exit_layer: Early exit for inference: the number of decoder layers to run when predicting
+            actions, after which the decoder's final norm and the action head are applied as usual. None runs
+            all the `n_decoder_layers`. Training always runs all the layers. See
+            `lerobot/scripts/eval_act_offline.py decoder-depth` for the latency and action error per depth.
         use_vae: Whether to use a variational objective during training. This introduces another transformer
             which is used as the VAE's encoder (not to be confused with the transformer encoder - see
             documentation in the policy class).
         latent_dim: The VAE's latent dimension.
         n_vae_encoder_layers: The number of transformer layers to use for the VAE's encoder.
+        inference_only: Whether to build the model without the VAE encoder (and its projections and positional
+            embedding), which are only used to compute the loss during training. Set by the inference-only
+            export (see `lerobot/common/policies/act/inference_act.py`). A policy built this way can't be
+            trained.
         temporal_ensemble_coeff: Coefficient for the exponential weighting scheme to apply for temporal
             ensembling. Defaults to None which means temporal ensembling is not used. `n_action_steps` must be
             1 when using this feature, as inference needs to happen at every step to form an ensemble. For
             more information on how ensembling works, please see `ACTTemporalEnsembler`.
+        temporal_ensemble_stride: When using temporal ensembling, the number of steps between two policy
+            queries. Each new action chunk is blended into the running ensemble, and the steps in between are
+            served from the ensemble. So a stride of k keeps most of the smoothing for 1/k of the inference
+            compute. Must be between 1 (query every step, as in the original ACT) and `chunk_size`.
+        prefetch_low_water_mark: When set, `select_action` starts predicting the next action chunk in a
+            background thread as soon as the action queue holds this many actions or fewer, using the latest
+            observation. The new chunk replaces the queued actions once ready, starting at the action for the
+            current step. This hides the model's latency from the control loop as long as inference takes
+            fewer than `prefetch_low_water_mark` control steps. Defaults to None which means the policy is
+            queried synchronously when the queue is empty. Must be in [1, `n_action_steps`) and can't be used
+            with temporal ensembling.
         dropout: Dropout to use in the transformer layers (see code for details).
         kl_weight: The weight to use for the KL-divergence component of the loss if the variational objective
             is enabled. Loss is then calculated as: `reconstruction_loss + kl_weight * kld_loss`.
+        distillation_loss_weight: The weight of the L1 loss to a teacher policy's predicted action chunks
+            ("teacher_action" in the batch), when distilling a policy into this one (see
+            `training.distillation_teacher_path` in `train.py`). It's added to the loss described above.
+        activation_checkpointing: Modules whose activations aren't kept for the backward pass in training, but
+            recomputed instead, which trades compute for memory (hence larger batches). Any of "backbone" (per
+            backbone block), "vae_encoder", "encoder" and "decoder" (per transformer layer). See
+            `benchmark_act.py activation-checkpointing` for the step time and memory of each.
+        capture_input_gradients: Whether to track the gradients w.r.t. the camera images and the frame index
+            during training, for the saliency and phase gradient analyses. The inputs and predicted actions of
+            the last training step are then kept in `ACTPolicy.diagnostics`. This costs memory and compute, so
+            leave it off for regular training.
     """
 
     # Input / output structure.
@@ -115,31 +183,45 @@ class ACTConfig:
         }
     )
 
+    # Image preprocessing.
+    image_crops: dict[str, list[int]] = field(default_factory=dict)
+    image_resize_shapes: dict[str, list[int]] = field(default_factory=dict)
+
     # Architecture.
     # Vision backbone.
     vision_backbone: str = "resnet18"
     pretrained_backbone_weights: str | None = "ResNet18_Weights.IMAGENET1K_V1"
     replace_final_stride_with_dilation: int = False
+    freeze_backbone: bool = False
+    batch_cameras_in_backbone: bool = True
+    image_token_reduction: str | None = None
+    image_token_pool_stride: int = 2
+    image_token_topk: int = 64
     # Transformer layers.
     pre_norm: bool = False
     dim_model: int = 512
     n_heads: int = 8
     dim_feedforward: int = 3200
     feedforward_activation: str = "relu"
+    attention_backend: str = "mha"
     n_encoder_layers: int = 4
     # Note: Although the original ACT implementation has 7 for `n_decoder_layers`, there is a bug in the code
     # that means only the first layer is used. Here we match the original implementation by setting this to 1.
     # See this issue https://github.com/tonyzhaozh/act/issues/25#issue-2258740521.
     n_decoder_layers: int = 99 #1
+    decoder_exit_layer: int | None = None
     # VAE.
     use_vae: bool = True
     latent_dim: int = 32
     n_vae_encoder_layers: int = 4
+    inference_only: bool = False
 
     # Inference.
     # Note: the value used in ACT when temporal ensembling is enabled is 0.01.
     temporal_ensemble_coeff: float | None = None
     #temporal_ensemble_coeff: float = 0.01 #dharun
+    temporal_ensemble_stride: int = 1
+    prefetch_low_water_mark: int | None = None
     time_embed: bool = True
     max_ep_time: int = 1024  # 33secs
 
@@ -147,18 +229,72 @@ class ACTConfig:
     # Training and loss computation.
     dropout: float = 0.1
     kl_weight: float = 10.0
+    distillation_loss_weight: float = 1.0
+    activation_checkpointing: list[str] = field(default_factory=list)
+
+    # Diagnostics.
+    capture_input_gradients: bool = False
 
     def __post_init__(self):
         """Input validation (not exhaustive)."""
-        if not self.vision_backbone.startswith("resnet"):
+        if not self.vision_backbone.startswith(VISION_BACKBONE_FAMILIES):
+            raise ValueError(
+                f"`vision_backbone` must be one of the {', '.join(VISION_BACKBONE_FAMILIES)} variants. Got "
+                f"{self.vision_backbone}."
+            )
+        if self.replace_final_stride_with_dilation and not self.vision_backbone.startswith("resnet"):
             raise ValueError(
-                f"`vision_backbone` must be one of the ResNet variants. Got {self.vision_backbone}."
+                "`replace_final_stride_with_dilation` is only supported for the ResNet backbones."
             )
         if self.temporal_ensemble_coeff is not None and self.n_action_steps > 1:
             raise NotImplementedError(
                 "`n_action_steps` must be 1 when using temporal ensembling. This is "
                 "because the policy needs to be queried every step to compute the ensembled action."
             )
+        if self.decoder_exit_layer is not None and not 1 <= self.decoder_exit_layer <= self.n_decoder_layers:
+            raise ValueError(
+                "`decoder_exit_layer` must be between 1 and `n_decoder_layers` "
+                f"({self.n_decoder_layers}). Got {self.decoder_exit_layer}."
+            )
+        if not set(self.activation_checkpointing) <= set(ACTIVATION_CHECKPOINTING_MODULES):
+            raise ValueError(
+                f"`activation_checkpointing` must only contain {ACTIVATION_CHECKPOINTING_MODULES}. Got "
+                f"{self.activation_checkpointing}."
+            )
+        if self.image_token_reduction not in (None, "pool", "topk"):
+            raise ValueError(
+                "`image_token_reduction` must be one of None, 'pool' or 'topk'. Got "
+                f"{self.image_token_reduction}."
+            )
+        if self.image_token_pool_stride < 1 or self.image_token_topk < 1:
+            raise ValueError(
+                "`image_token_pool_stride` and `image_token_topk` must be at least 1. Got "
+                f"{self.image_token_pool_stride} and {self.image_token_topk}."
+            )
+        if self.attention_backend not in ("mha", "sdpa"):
+            raise ValueError(
+                f"`attention_backend` must be one of 'mha' or 'sdpa'. Got {self.attention_backend}."
+            )
+        if not 1 <= self.temporal_ensemble_stride <= self.chunk_size:
+            raise ValueError(
+                "`temporal_ensemble_stride` must be between 1 and `chunk_size`, as each action chunk only "
+                f"covers `chunk_size` steps. Got {self.temporal_ensemble_stride} for "
+                f"`temporal_ensemble_stride` and {self.chunk_size} for `chunk_size`."
+            )
+        if self.temporal_ensemble_stride > 1 and self.temporal_ensemble_coeff is None:
+            raise ValueError("`temporal_ensemble_stride` only applies when `temporal_ensemble_coeff` is set.")
+        if self.prefetch_low_water_mark is not None:
+            if self.temporal_ensemble_coeff is not None:
+                raise NotImplementedError(
+                    "`prefetch_low_water_mark` can't be used with temporal ensembling, as the policy is "
+                    "already queried every step to compute the ensembled action."
+                )
+            if not 1 <= self.prefetch_low_water_mark < self.n_action_steps:
+                raise ValueError(
+                    "`prefetch_low_water_mark` must be at least 1 and lower than `n_action_steps`. Got "
+                    f"{self.prefetch_low_water_mark} for `prefetch_low_water_mark` and {self.n_action_steps} "
+                    "for `n_action_steps`."
+                )
         if self.n_action_steps > self.chunk_size:
             raise ValueError(
                 f"The chunk size is the upper bound for the number of action steps per model invocation. Got "
@@ -173,3 +309,29 @@ class ACTConfig:
             and "observation.environment_state" not in self.input_shapes
         ):
             raise ValueError("You must provide at least one image or the environment state among the inputs.")
+        image_keys = [k for k in self.input_shapes if k.startswith("observation.image")]
+        for key in [*self.image_crops, *self.image_resize_shapes]:
+            if key not in image_keys:
+                raise ValueError(f"Image crops and resize shapes must be for camera inputs. Got {key}.")
+        for key, crop in self.image_crops.items():
+            _, height, width = self.input_shapes[key]
+            top, left, crop_height, crop_width = crop
+            if not (0 <= top < top + crop_height <= height and 0 <= left < left + crop_width <= width):
+                raise ValueError(
+                    f"The [top, left, height, width] crop {crop} of {key} doesn't fit in its "
+                    f"{height}x{width} images."
+                )
+        if len({tuple(self.image_shape(key)) for key in image_keys}) > 1:
+            raise ValueError(
+                "All cameras must have the same shape after the image crops and resizes. Got "
+                f"{ {key: self.image_shape(key) for key in image_keys} }."
+            )
+
+    def image_shape(self, key: str) -> list[int]:
+        """The [C, H, W] shape of the images of camera `key` after its crop and resize."""
+        channels, height, width = self.input_shapes[key]
+        if key in self.image_crops:
+            height, width = self.image_crops[key][2:]
+        if key in self.image_resize_shapes:
+            height, width = self.image_resize_shapes[key]
+        return [channels, height, width]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Backbone feature cache for training ACT with a frozen vision backbone.
+
+With `freeze_backbone`, the backbone's feature maps of a frame never change during training, so they can be
+computed once for the whole dataset rather than at every step (along with decoding the camera frames). The
+cache holds one float16 memory-mapped array per camera with the feature maps of every frame, and an index of
+the (episode_index, frame_index) of each row:
+```
+build_image_feature_cache(policy, dataset, cache_dir)
+dataset = ACTImageFeatureDataset(dataset, cache_dir)
+```
+The items of `ACTImageFeatureDataset` hold the feature maps of all the cameras in "observation.image_features"
+instead of the camera images, which `ACTPolicy` and `ACT` consume in place of the images. `train.py` does
+this when `training.image_feature_cache_dir` is set.
+
+Note that the image augmentations of the dataset (if any) are applied once, when the cache is built.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from lerobot.common.datasets.lerobot_dataset import LeRobotDataset
+from lerobot.common.datasets.utils import hf_transform_to_torch, load_previous_and_future_frames
+from lerobot.common.policies.act.modeling_act import ACTPolicy
+
+IMAGE_FEATURES_KEY = "observation.image_features"
+INDEX_FILE = "index.npy"
+META_FILE = "meta.json"
+
+
+def _image_feature_fingerprint(policy: ACTPolicy) -> str:
+    """Hash of everything the cached feature maps depend on: the image preprocessing configuration, the image
+    normalization statistics and the backbone weights."""
+    config = policy.config
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            [
+                config.vision_backbone,
+                policy.expected_image_keys,
+                config.image_crops,
+                config.image_resize_shapes,
+            ]
+        ).encode()
+    )
+    tensors = [
+        buffer
+        for name, buffer in policy.normalize_inputs.state_dict().items()
+        if any(name.startswith("buffer_" + key.replace(".", "_")) for key in policy.expected_image_keys)
+    ]
+    tensors += list(policy.model.backbone.state_dict().values())
+    for tensor in tensors:
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _feature_file(cache_dir: Path, key: str) -> Path:
+    return cache_dir / f"{key}.npy"
+
+
+@torch.no_grad()
+def build_image_feature_cache(
+    policy: ACTPolicy,
+    dataset: LeRobotDataset,
+    cache_dir: str | Path,
+    batch_size: int = 32,
+    num_workers: int = 0,
+) -> Path:
+    """Compute the backbone feature maps of every frame of `dataset` and store them in `cache_dir`.
+
+    An existing cache built with the same backbone weights, image normalization and image preprocessing is
+    reused as is. A cache built with a different one raises an error, as it would silently train on the wrong
+    features; delete it to rebuild it.
+    """
+    if not policy.config.freeze_backbone:
+        raise ValueError("The image features can only be cached for a policy with `freeze_backbone`.")
+    cache_dir = Path(cache_dir)
+    fingerprint = _image_feature_fingerprint(policy)
+    if (cache_dir / META_FILE).exists():
+        meta = json.loads((cache_dir / META_FILE).read_text())
+        if meta["fingerprint"] != fingerprint or meta["num_samples"] != len(dataset):
+            raise ValueError(
+                f"The image feature cache in {cache_dir} was built for another backbone, image preprocessing "
+                "or dataset. Delete it to rebuild it."
+            )
+        logging.info(f"Using the image feature cache in {cache_dir}.")
+        return cache_dir
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    logging.info(f"Building the image feature cache in {cache_dir} for {len(dataset)} frames.")
+    device = next(policy.parameters()).device
+    was_training = policy.training
+    policy.eval()
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type != "cpu",
+    )
+    index = np.lib.format.open_memmap(
+        cache_dir / INDEX_FILE, mode="w+", dtype=np.int64, shape=(len(dataset), 2)
+    )
+    features = {}
+    row = 0
+    for batch in dataloader:
+        batch = {k: v.to(device, non_blocking=True) for k, v in batch.items() if isinstance(v, Tensor)}
+        images = policy._prepare_inputs(batch)["observation.images"]
+        for cam_index, key in enumerate(policy.expected_image_keys):
+            feature_map = policy.model.backbone(images[:, cam_index])["feature_map"]
+            if key not in features:
+                features[key] = np.lib.format.open_memmap(
+                    _feature_file(cache_dir, key),
+                    mode="w+",
+                    dtype=np.float16,
+                    shape=(len(dataset), *feature_map.shape[1:]),
+                )
+            features[key][row : row + len(feature_map)] = feature_map.half().cpu().numpy()
+        index[row : row + len(images), 0] = batch["episode_index"].cpu().numpy()
+        index[row : row + len(images), 1] = batch["frame_index"].flatten().cpu().numpy()
+        row += len(images)
+    for array in [index, *features.values()]:
+        array.flush()
+    policy.train(was_training)
+
+    # The metadata is written last, so that an interrupted build isn't mistaken for a complete cache.
+    meta = {
+        "fingerprint": fingerprint,
+        "num_samples": len(dataset),
+        "camera_keys": policy.expected_image_keys,
+        "feature_shape": list(next(iter(features.values())).shape[1:]),
+    }
+    (cache_dir / META_FILE).write_text(json.dumps(meta, indent=4))
+    return cache_dir
+
+
+class ACTImageFeatureDataset(torch.utils.data.Dataset):
+    """Wraps a `LeRobotDataset` to serve the cached backbone feature maps of its frames (see
+    `build_image_feature_cache`) instead of its camera images, which are never decoded.
+
+    The items hold the (n_cameras, C, h, w) float16 feature maps of the cameras in
+    "observation.image_features", and all the other keys of the wrapped dataset's items.
+    """
+
+    def __init__(self, dataset: LeRobotDataset, cache_dir: str | Path):
+        if dataset.delta_timestamps is not None and any(
+            key in dataset.delta_timestamps for key in dataset.camera_keys
+        ):
+            raise ValueError("The image feature cache only holds the images of the current frame.")
+        self.dataset = dataset
+        self.cache_dir = Path(cache_dir)
+        meta = json.loads((self.cache_dir / META_FILE).read_text())
+        if meta["num_samples"] != dataset.num_samples:
+            raise ValueError(f"The image feature cache in {cache_dir} was built for another dataset.")
+        self.camera_keys = meta["camera_keys"]
+        # The frames without their camera images (or videos).
+        self.hf_dataset = dataset.hf_dataset.remove_columns(
+            [key for key in dataset.camera_keys if key in dataset.hf_dataset.column_names]
+        )
+        self.hf_dataset.set_transform(hf_transform_to_torch)
+        index = np.load(self.cache_dir / INDEX_FILE)
+        self._rows = {
+            (episode_index, frame_index): row
+            for row, (episode_index, frame_index) in enumerate(index.tolist())
+        }
+        # Opened lazily, in each dataloader worker.
+        self._features = None
+
+    @property
+    def num_samples(self) -> int:
+        return self.dataset.num_samples
+
+    @property
+    def num_episodes(self) -> int:
+        return self.dataset.num_episodes
+
+    @property
+    def episode_data_index(self) -> dict[str, Tensor]:
+        return self.dataset.episode_data_index
+
+    @property
+    def stats(self) -> dict[str, dict[str, Tensor]]:
+        return self.dataset.stats
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def __getstate__(self) -> dict:
+        # Don't pickle the memory maps (e.g. to dataloader workers), as their content would be copied.
+        return {**self.__dict__, "_features": None}
+
+    def __getitem__(self, idx: int) -> dict[str, Tensor]:
+        if self._features is None:
+            self._features = [
+                np.load(_feature_file(self.cache_dir, key), mmap_mode="r") for key in self.camera_keys
+            ]
+        item = self.hf_dataset[idx]
+        if self.dataset.delta_timestamps is not None:
+            item = load_previous_and_future_frames(
+                item,
+                self.hf_dataset,
+                self.dataset.episode_data_index,
+                self.dataset.delta_timestamps,
+                self.dataset.tolerance_s,
+            )
+        row = self._rows[(item["episode_index"].item(), item["frame_index"].item())]
+        item[IMAGE_FEATURES_KEY] = torch.from_numpy(np.stack([features[row] for features in self._features]))
+        return item
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Deployment utilities for a trained ACT policy.
+
+Everything in here transforms or wraps an `ACTPolicy` for inference on the robot. None of it is needed for
+training.
+"""
+
+import copy
+import json
+import logging
+import time
+from dataclasses import fields, replace
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+from huggingface_hub import snapshot_download
+from huggingface_hub.constants import CONFIG_NAME, SAFETENSORS_SINGLE_FILE
+from safetensors import safe_open
+from torch import Tensor, nn
+from torch.nn.utils.fusion import fuse_conv_bn_weights
+from torchvision.ops.misc import FrozenBatchNorm2d
+
+from lerobot.common.policies.act.configuration_act import ACTConfig
+from lerobot.common.policies.act.modeling_act import ACTAttention, ACTDecoder, ACTEncoder, ACTPolicy
+
+# Prefix shared by the state dict keys of all the modules only used by the VAE encoder (the encoder itself,
+# its cls token embedding, its input/output projections and its positional embedding buffer).
+VAE_ENCODER_STATE_DICT_PREFIX = "model.vae_encoder"
+
+# Submodules of `ACT` whose precision can be set with `make_mixed_precision_policy`.
+PRECISION_SUBMODULES = ("backbone", "encoder", "decoder")
+PRECISION_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+# Keys of the prepared inputs (see `ACTPolicy._prepare_inputs`) read by `ACT.forward` at inference time.
+ACT_INPUT_KEYS = ("observation.images", "observation.state", "observation.environment_state", "frame_index")
+
+
+def make_inference_policy(policy: ACTPolicy) -> ACTPolicy:
+    """Make an inference-only copy of `policy`, without the modules that are only used for training.
+
+    At inference time the latent is set to zeros, so the VAE encoder is dead weight. The returned policy's
+    config has `inference_only=True`, and its weights are a copy of `policy`'s (without the VAE encoder's),
+    on the same device.
+
+    The pretrained backbone weights are also disabled in the config, as the checkpoint already holds the
+    backbone weights. This avoids downloading them when loading the inference-only policy.
+    """
+    if policy.config.inference_only:
+        return policy
+    config = replace(policy.config, inference_only=True, pretrained_backbone_weights=None)
+    inference_policy = ACTPolicy(config)
+    state_dict = {
+        k: v for k, v in policy.state_dict().items() if not k.startswith(VAE_ENCODER_STATE_DICT_PREFIX)
+    }
+    # Note: strict loading makes sure that we only ever drop the VAE encoder's weights.
+    inference_policy.load_state_dict(state_dict)
+    return inference_policy.to(next(policy.parameters()).device)
+
+
+def export_inference_checkpoint(policy: ACTPolicy, output_dir: str | Path) -> ACTPolicy:
+    """Save an inference-only version of `policy` to `output_dir` with `save_pretrained`.
+
+    The exported directory holds a `config.json` and a `model.safetensors`, like any other pretrained policy,
+    and can be loaded with `load_inference_policy` (or `ACTPolicy.from_pretrained`).
+    """
+    inference_policy = make_inference_policy(policy)
+    inference_policy.save_pretrained(output_dir)
+    return inference_policy
+
+
+def load_inference_policy(pretrained_policy_name_or_path: str | Path, **kwargs) -> ACTPolicy:
+    """Load a slim `ACTPolicy` for inference, in eval mode.
+
+    `pretrained_policy_name_or_path` is either a local directory or the repo ID of a model hosted on the Hub,
+    holding an inference-only checkpoint written by `export_inference_checkpoint` or a full checkpoint. The
+    slim policy is built directly from the config, and only the weights it needs are read from the checkpoint
+    file, so the VAE encoder of a full checkpoint is never loaded in memory. `kwargs` are passed on to
+    `huggingface_hub.snapshot_download` for repo IDs (e.g. `revision`).
+    """
+    path = Path(pretrained_policy_name_or_path)
+    if not path.is_dir():
+        path = Path(
+            snapshot_download(
+                str(pretrained_policy_name_or_path),
+                allow_patterns=[CONFIG_NAME, SAFETENSORS_SINGLE_FILE],
+                **kwargs,
+            )
+        )
+    config = json.loads((path / CONFIG_NAME).read_text())
+    config = ACTConfig(**{k: v for k, v in config.items() if k in {f.name for f in fields(ACTConfig)}})
+    # The backbone weights are in the checkpoint, don't download the pretrained ones.
+    config = replace(config, inference_only=True, pretrained_backbone_weights=None)
+    policy = ACTPolicy(config)
+    with safe_open(path / SAFETENSORS_SINGLE_FILE, framework="pt") as f:
+        state_dict = {k: f.get_tensor(k) for k in policy.state_dict()}
+    policy.load_state_dict(state_dict)
+    return policy.eval()
+
+
+def replace_multihead_attention(module: nn.Module) -> nn.Module:
+    """Replace (in place) all the `nn.MultiheadAttention` submodules of `module` by equivalent `ACTAttention`
+    modules, with the same weights.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, nn.MultiheadAttention):
+            attention = ACTAttention(child.embed_dim, child.num_heads, dropout=child.dropout)
+            attention.load_state_dict(child.state_dict())
+            attention.to(child.in_proj_weight.device).train(child.training)
+            setattr(module, name, attention)
+        else:
+            replace_multihead_attention(child)
+    return module
+
+
+def quantize_dynamic_int8(policy: ACTPolicy, quantize_backbone: bool = False) -> ACTPolicy:
+    """Make a copy of `policy` for CPU inference, with dynamic INT8 quantization of the transformer layers.
+
+    All the `nn.Linear` layers of the transformer encoder and decoder are quantized: the feed-forward layers
+    and the attention projections (for which the attention modules are converted to `ACTAttention` with
+    separate input projections). Weights are quantized ahead of time, and activations on the fly. The input
+    and output projections (like the action head) stay in float32.
+
+    If `quantize_backbone` is set, the convolutions of the vision backbone are dynamically quantized too. This
+    trades more accuracy for a smaller model, so check the action-space error with
+    `lerobot/scripts/eval_act_offline.py quantize` first.
+    """
+    if next(policy.parameters()).device.type != "cpu":
+        raise ValueError(
+            "Dynamic quantization is only supported for CPU inference. Move the policy to CPU first."
+        )
+    policy = copy.deepcopy(policy).eval()
+    for transformer in [policy.model.encoder, policy.model.decoder]:
+        replace_multihead_attention(transformer)
+        for module in transformer.modules():
+            if isinstance(module, ACTAttention):
+                module.split_in_proj()
+        torch.ao.quantization.quantize_dynamic(transformer, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    if quantize_backbone:
+        torch.ao.quantization.quantize_dynamic(
+            policy.model.backbone,
+            {nn.Conv2d: torch.ao.quantization.default_dynamic_qconfig},
+            mapping={nn.Conv2d: torch.ao.nn.quantized.dynamic.Conv2d},
+            inplace=True,
+        )
+    return policy
+
+
+def _cast_floating(obj, dtype: torch.dtype):
+    """Cast the floating point tensors in `obj` (possibly nested in tuples, lists and dicts) to `dtype`."""
+    if isinstance(obj, torch.Tensor):
+        return obj.to(dtype) if obj.is_floating_point() else obj
+    if isinstance(obj, dict):
+        return {k: _cast_floating(v, dtype) for k, v in obj.items()}
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(_cast_floating(v, dtype) for v in obj)
+    return obj
+
+
+def _run_in_dtype(module: nn.Module, compute_dtype: torch.dtype, output_dtype: torch.dtype):
+    """Register hooks so that `module` gets its floating point inputs in `compute_dtype` and returns its
+    outputs in `output_dtype`."""
+    module.register_forward_pre_hook(
+        lambda _, args, kwargs: (_cast_floating(args, compute_dtype), _cast_floating(kwargs, compute_dtype)),
+        with_kwargs=True,
+    )
+    module.register_forward_hook(lambda _, __, output: _cast_floating(output, output_dtype))
+
+
+def make_mixed_precision_policy(
+    policy: ACTPolicy, precision: str | dict[str, str] | None = None
+) -> ACTPolicy:
+    """Make a copy of `policy` for inference with some submodules in reduced precision.
+
+    `precision` maps the submodules in `PRECISION_SUBMODULES` ("backbone", "encoder" and "decoder") to one of
+    "float32", "bfloat16" or "float16". Submodules that are not in the map stay in float32. A single dtype
+    name applies to all of them, and None means "bfloat16" on CPU and "float16" on other devices.
+
+    Each reduced precision submodule casts its inputs on the way in and its outputs back to float32 on the way
+    out, so the rest of the model (the input projections and the action head) runs in float32. So do the
+    LayerNorms inside the transformer layers, for which the activations are upcast, and the final
+    normalization of the encoder and decoder, such that the action head gets float32 features.
+    """
+    device = next(policy.parameters()).device
+    if precision is None:
+        precision = "bfloat16" if device.type == "cpu" else "float16"
+    if isinstance(precision, str):
+        precision = dict.fromkeys(PRECISION_SUBMODULES, precision)
+    for name, dtype_name in precision.items():
+        if name not in PRECISION_SUBMODULES:
+            raise ValueError(f"Can't set the precision of {name}. Expected one of {PRECISION_SUBMODULES}.")
+        if dtype_name not in PRECISION_DTYPES:
+            raise ValueError(
+                f"Unsupported precision {dtype_name} for {name}. Expected one of {list(PRECISION_DTYPES)}."
+            )
+
+    policy = copy.deepcopy(policy).eval()
+    for name, dtype_name in precision.items():
+        dtype = PRECISION_DTYPES[dtype_name]
+        if dtype == torch.float32:
+            continue
+        submodule = getattr(policy.model, name)
+        submodule.to(dtype)
+        _run_in_dtype(submodule, dtype, torch.float32)
+        for module in submodule.modules():
+            if isinstance(module, (ACTEncoder, ACTDecoder)) and isinstance(module.norm, nn.LayerNorm):
+                # The output of the final normalization goes straight out of the submodule.
+                module.norm.float()
+                _run_in_dtype(module.norm, torch.float32, torch.float32)
+        for module in submodule.modules():
+            if isinstance(module, nn.LayerNorm) and module.weight.dtype != torch.float32:
+                module.float()
+                _run_in_dtype(module, torch.float32, dtype)
+    return policy
+
+
+def fuse_conv_frozen_batch_norm(module: nn.Module) -> nn.Module:
+    """Fold each `FrozenBatchNorm2d` layer of `module` that directly follows an `nn.Conv2d` into the conv's
+    weights and bias (in place), and replace it with an `nn.Identity`.
+
+    A frozen batch norm is a constant per-channel affine transform, so the fused conv computes the same thing
+    (up to float rounding) in a single op. "Directly follows" is taken from the order in which the layers are
+    registered in their parent module, which matches the order they run in for the torchvision backbones
+    (`conv1`/`bn1` pairs of the ResNet blocks and stem, the `downsample` branches, and the
+    `Conv2dNormActivation` layers of the other families). Returns `module`.
+    """
+    previous = None
+    for name, child in module.named_children():
+        if isinstance(child, FrozenBatchNorm2d) and isinstance(previous, nn.Conv2d):
+            weight, bias = fuse_conv_bn_weights(
+                previous.weight,
+                previous.bias,
+                child.running_mean,
+                child.running_var,
+                child.eps,
+                child.weight,
+                child.bias,
+            )
+            previous.weight, previous.bias = weight, bias
+            setattr(module, name, nn.Identity())
+        else:
+            fuse_conv_frozen_batch_norm(child)
+        previous = child
+    return module
+
+
+def make_fused_backbone_policy(policy: ACTPolicy, channels_last: bool = True) -> ACTPolicy:
+    """Make a copy of `policy` for inference, with the frozen batch norms of the vision backbone folded into
+    the preceding convolutions (see `fuse_conv_frozen_batch_norm`).
+
+    If `channels_last` is set, the backbone's weights and input images are also converted to the channels
+    last (NHWC) memory format, which the CPU (oneDNN) and cuDNN convolution kernels are usually faster with.
+    The outputs are the same up to float rounding; check them with `lerobot/scripts/eval_act_offline.py
+    fuse-backbone`. The copy's state dict doesn't match `ACTPolicy`'s anymore, so don't save it as a
+    checkpoint.
+    """
+    policy = copy.deepcopy(policy).eval()
+    backbone = policy.model.backbone
+    with torch.no_grad():
+        fuse_conv_frozen_batch_norm(backbone)
+    if channels_last:
+        backbone.to(memory_format=torch.channels_last)
+        backbone.register_forward_pre_hook(
+            lambda _, args: tuple(
+                arg.contiguous(memory_format=torch.channels_last) if isinstance(arg, Tensor) else arg
+                for arg in args
+            )
+        )
+    return policy
+
+
+def make_example_observation(
+    config: ACTConfig, batch_size: int = 1, device: str | torch.device = "cpu"
+) -> dict[str, Tensor]:
+    """Make a dummy observation with the shapes and dtypes expected by `ACTPolicy.select_action`.
+
+    Useful to warm up inference backends at load time, before the robot is connected.
+    """
+    observation = {}
+    for key, shape in config.input_shapes.items():
+        observation[key] = torch.zeros(batch_size, *shape, device=device)
+    if config.time_embed:
+        observation["frame_index"] = torch.zeros(batch_size, 1, device=device)
+    return observation
+
+
+class ACTObservationPreprocessor:
+    """Turns a raw robot observation into the prepared model inputs of an `ACTPolicy`, in one pass.
+
+    The robot (see `ManipulatorRobot.capture_observation`) returns one (H, W, C) uint8 frame per camera and
+    an unbatched state. Each frame is copied once into a preallocated (1, n_cameras, C, H, W) float32 buffer
+    on the policy's device (the copy does the dtype conversion and the channel-first permutation), then the
+    whole buffer is normalized in place. The division by 255 and the policy's normalization are folded into
+    a single per-channel scale and shift. On accelerators, the frames are transferred as uint8, which moves 4x
+    less data than float32. The cameras' crops (see `ACTConfig.image_crops`) are taken from the uint8 frames
+    before anything is copied, and their resizes go through one intermediate float32 buffer per camera.
+
+    The output is what `ACTPolicy._prepare_inputs` returns, so pass it with
+    `policy.select_action(inputs, preprocessed=True)`. Note that the output tensors are overwritten by the
+    next call.
+
+    Usage:
+    ```
+    preprocess = ACTObservationPreprocessor(policy)
+    action = policy.select_action(preprocess(robot.capture_observation()), preprocessed=True)
+    ```
+    """
+
+    def __init__(self, policy: ACTPolicy):
+        config = policy.config
+        self.image_keys = policy.expected_image_keys
+        self.state_keys = [
+            k for k in config.input_shapes if k.startswith("observation.") and "image" not in k
+        ]
+        device = next(policy.parameters()).device
+
+        affine = policy.input_normalization_affine(self.image_keys + self.state_keys)
+        scales, shifts = zip(*[affine[k] for k in self.image_keys], strict=True)
+        # The images are in [0, 255] rather than [0, 1].
+        self._image_scale = torch.stack(scales) / 255
+        self._image_shift = torch.stack(shifts)
+        self._state_affine = {k: affine[k] for k in self.state_keys}
+
+        self.frame_shapes = {}
+        self._crops = {}
+        # Per camera, the uint8 staging buffer for the host to device transfer (on CPU, the frames are read
+        # directly), and the float32 buffer for the cropped image when it gets resized.
+        self._frames = {}
+        self._resize_inputs = {}
+        for key in self.image_keys:
+            c, h, w = config.input_shapes[key]
+            self.frame_shapes[key] = (h, w, c)
+            top, left = 0, 0
+            if key in config.image_crops:
+                top, left, h, w = config.image_crops[key]
+            self._crops[key] = (slice(top, top + h), slice(left, left + w))
+            if device.type != "cpu":
+                self._frames[key] = torch.empty(h, w, c, dtype=torch.uint8, device=device)
+            if key in config.image_resize_shapes:
+                self._resize_inputs[key] = torch.empty(1, c, h, w, device=device)
+        self._images = torch.empty(
+            1, len(self.image_keys), *config.image_shape(self.image_keys[0]), device=device
+        )
+        self._states = {k: torch.empty(1, *config.input_shapes[k], device=device) for k in self.state_keys}
+        self._frame_index = torch.empty(1, 1, device=device)
+
+    @torch.no_grad
+    def __call__(self, observation: dict[str, Tensor]) -> dict[str, Tensor]:
+        for i, key in enumerate(self.image_keys):
+            frame = torch.as_tensor(observation[key])
+            if tuple(frame.shape) != self.frame_shapes[key]:
+                raise ValueError(
+                    f"Expected a {self.frame_shapes[key]} frame for {key}, got {tuple(frame.shape)}."
+                )
+            frame = frame[self._crops[key]]
+            if key in self._frames:
+                frame = self._frames[key].copy_(frame)
+            if key in self._resize_inputs:
+                image = self._resize_inputs[key].copy_(frame.permute(2, 0, 1).unsqueeze(0))
+                image = F.interpolate(
+                    image, size=self._images.shape[-2:], mode="bilinear", align_corners=False, antialias=True
+                )
+                self._images[:, i].copy_(image)
+            else:
+                self._images[0, i].copy_(frame.permute(2, 0, 1))
+        torch.addcmul(self._image_shift, self._images, self._image_scale, out=self._images)
+
+        inputs = {"observation.images": self._images}
+        for key in self.state_keys:
+            scale, shift = self._state_affine[key]
+            state = self._states[key]
+            state[0].copy_(torch.as_tensor(observation[key]))
+            inputs[key] = torch.addcmul(shift, state, scale, out=state)
+        if "frame_index" in observation:
+            self._frame_index.copy_(torch.as_tensor(observation["frame_index"]).reshape(1, 1))
+            inputs["frame_index"] = self._frame_index
+        return inputs
+
+
+class ACTCompiledEngine:
+    """Inference backend running a `torch.compile`d `ACT.forward` for one fixed input signature.
+
+    The deployment always feeds the same input shapes (e.g. batch size 1, 2 cameras at 3x480x640, a 6-dim
+    state and a frame index), so the model is compiled with static shapes for the signature of
+    `example_observation`, and warmed up right away. Inputs with any other signature (shapes, dtypes or
+    devices) run the eager model instead, so that they don't trigger a recompilation in the control loop.
+
+    Usage:
+    ```
+    engine = ACTCompiledEngine(policy, make_example_observation(policy.config, device=device))
+    policy.set_inference_backend(engine)
+    ```
+
+    Apply the other transforms of this module (e.g. `make_mixed_precision_policy`) before compiling.
+    """
+
+    def __init__(
+        self,
+        policy: ACTPolicy,
+        example_observation: dict[str, Tensor],
+        mode: str | None = None,
+        n_warmup: int = 3,
+    ):
+        """
+        Args:
+            policy: The policy whose model gets compiled. It's put in eval mode.
+            example_observation: An observation with the signature to compile for, as passed to
+                `select_action`.
+            mode: The `torch.compile` mode (e.g. "reduce-overhead" or "max-autotune").
+            n_warmup: Number of warm-up calls after compilation.
+        """
+        self.model = policy.eval().model
+        self.model.prepare_for_inference()
+        self._compiled_forward = torch.compile(self._forward, mode=mode, dynamic=False)
+        # Number of calls that ran the eager model because their signature didn't match.
+        self.n_fallbacks = 0
+
+        with torch.no_grad():
+            # Go through the policy to get the model inputs, as they'll be at inference time.
+            example_inputs = policy._prepare_inputs(example_observation)
+            self.signature = self._signature(example_inputs)
+            start = time.perf_counter()
+            self._compiled_forward(example_inputs)
+            self.compile_s = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(n_warmup):
+                self._compiled_forward(example_inputs)
+            self.warmup_s = time.perf_counter() - start
+        logging.info(f"Compiled ACT in {self.compile_s:.1f}s (warm-up: {self.warmup_s:.1f}s).")
+
+    def _forward(self, batch: dict[str, Tensor]) -> Tensor:
+        return self.model(batch)[0]
+
+    @staticmethod
+    def _signature(batch: dict[str, Tensor]) -> tuple:
+        return tuple(
+            sorted((k, tuple(v.shape), v.dtype, v.device) for k, v in batch.items() if k in ACT_INPUT_KEYS)
+        )
+
+    def __call__(self, batch: dict[str, Tensor]) -> Tensor:
+        if self.model.training or self._signature(batch) != self.signature:
+            self.n_fallbacks += 1
+            return self._forward(batch)
+        return self._compiled_forward(batch)
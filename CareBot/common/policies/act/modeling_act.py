@@ -19,8 +19,13 @@ As per Learning Fine-Grained Bimanual Manipulation with Low-Cost Hardware (https
 The majority of changes here involve removing unused code, unifying naming, and adding helpful comments.
 """
 
+import contextlib
+import copy
+import functools
 import math
-from collections import deque
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from itertools import chain
 from typing import Callable
 
@@ -28,6 +33,7 @@ import einops
 import numpy as np
 import torch
 import torch.nn.functional as F  # noqa: N812
+import torch.utils.checkpoint
 import torchvision
 from huggingface_hub import PyTorchModelHubMixin
 from torch import Tensor, nn
@@ -88,9 +94,28 @@ class ACTPolicy(
 
         self.expected_image_keys = [k for k in config.input_shapes if k.startswith("observation.image")]
 
+        # Inputs (with their gradients once `backward` is called) and predicted actions of the last training
+        # step. Only filled when `config.capture_input_gradients` is set.
+        self.diagnostics: dict[str, Tensor] = {}
+
         if config.temporal_ensemble_coeff is not None:
             self.temporal_ensembler = ACTTemporalEnsembler(config.temporal_ensemble_coeff, config.chunk_size)
 
+        # Background prediction of the next action chunk (see `config.prefetch_low_water_mark`). The worker
+        # thread is only started on first use.
+        self._prefetch_executor: ThreadPoolExecutor | None = None
+        self._prefetch_future: Future | None = None
+        self._n_steps_since_prefetch = 0
+        # Number of times the action queue ran dry before the prefetched chunk was ready.
+        self.n_prefetch_stalls = 0
+
+        self.select_action_latency = ACTLatencyTracker()
+        # Per-stage latencies, off by default (see `enable_stage_timing`). Shared with the model.
+        self.stage_timer = self.model.stage_timer
+
+        # Optional replacement for `self.model` at inference time (see `set_inference_backend`).
+        self._inference_backend: Callable[[dict[str, Tensor]], Tensor] | None = None
+
         self.reset()
 
     def reset(self):
@@ -99,60 +124,269 @@ class ACTPolicy(
             self.temporal_ensembler.reset()
         else:
             self._action_queue = deque([], maxlen=self.config.n_action_steps)
+        # Number of `select_action` calls since the last reset.
+        self._n_steps = 0
+        if self._prefetch_future is not None and not self._prefetch_future.cancel():
+            # Let the in-flight inference finish, but drop its result as it belongs to the previous episode.
+            wait([self._prefetch_future])
+        self._prefetch_future = None
+        self._n_steps_since_prefetch = 0
+
+    def __getstate__(self) -> dict:
+        # The prefetch worker thread and its pending chunk can't be copied (e.g. by `copy.deepcopy`). Copies
+        # start their own worker on first use.
+        return {**super().__getstate__(), "_prefetch_executor": None, "_prefetch_future": None}
 
     @torch.no_grad
-    def select_action(self, batch: dict[str, Tensor]) -> Tensor:
+    def select_action(
+        self, batch: dict[str, Tensor], preprocessed: bool = False, return_numpy: bool = False
+    ) -> Tensor | np.ndarray:
         """Select a single action given environment observations.
 
         This method wraps `select_actions` in order to return one action at a time for execution in the
         environment. It works by managing the actions in a queue and only calling `select_actions` when the
         queue is empty.
+
+        If `preprocessed` is True, `batch` holds the prepared model inputs (normalized, with the cameras
+        stacked in "observation.images"), for instance as returned by
+        `lerobot.common.policies.act.inference_act.ACTObservationPreprocessor`.
+
+        The actions are returned on CPU: each predicted chunk is copied to host memory once (pinned memory
+        for CUDA), and the following steps are served from that copy without any further device transfer or
+        synchronization. If `return_numpy` is True, the action is returned as a numpy array sharing the
+        memory of the host copy.
+
+        The latency of each call is recorded in `self.select_action_latency`.
+        """
+        start = time.perf_counter()
+        action = self._select_action(batch, preprocessed)
+        if return_numpy:
+            action = action.numpy()
+        self.select_action_latency.record(time.perf_counter() - start)
+        return action
+
+    def enable_stage_timing(self, enabled: bool = True):
+        """Record the latency of each stage of the inference steps (normalization, backbone, input projection,
+        encoder, decoder, action head and unnormalization) in `self.stage_timer`. See `ACTStageTimer`."""
+        self.stage_timer.enable(enabled, device=next(self.parameters()).device)
+
+    def set_inference_backend(self, backend: Callable[[dict[str, Tensor]], Tensor] | None):
+        """Run the model with `backend` instead of `self.model` in `select_action` and `predict_action_chunk`.
+
+        `backend` takes the model inputs (normalized, with the cameras stacked, as for `ACT.forward`) and
+        returns the (batch_size, chunk_size, action_dim) normalized actions. It's only used in eval mode, and
+        can be removed by passing None. See `lerobot/common/policies/act/inference_act.py` for backends.
+        """
+        self._inference_backend = backend
+
+    @torch.no_grad
+    def predict_action_chunk(self, batch: dict[str, Tensor]) -> Tensor:
+        """Predict a (batch_size, chunk_size, action_dim) chunk of actions from environment observations.
+
+        Unlike `select_action`, this bypasses the action queue and the temporal ensembling, so that the
+        model's predictions can be inspected directly. Target actions in `batch` (for instance in a dataset
+        item) are ignored, so that they're not fed to the VAE encoder.
         """
         self.eval()
+        batch = {k: v for k, v in batch.items() if k not in ("action", "action_is_pad")}
+        return self._predict_action_chunk(self._prepare_inputs(batch))
 
-        batch = self.normalize_inputs(batch)
-        if len(self.expected_image_keys) > 0:
-            batch = dict(batch)  # shallow copy so that adding a key doesn't modify the original
-            batch["observation.images"] = torch.stack([batch[k] for k in self.expected_image_keys], dim=-4)
+    def _select_action(self, batch: dict[str, Tensor], preprocessed: bool) -> Tensor:
+        self.eval()
+        inputs = batch if preprocessed else None
 
         # If we are doing temporal ensembling, do online updates where we keep track of the number of actions
-        # we are ensembling over.
+        # we are ensembling over. A new chunk is only predicted every `temporal_ensemble_stride` steps.
         if self.config.temporal_ensemble_coeff is not None:
-            actions = self.model(batch)[0]  # (batch_size, chunk_size, action_dim)
-            actions = self.unnormalize_outputs({"action": actions})["action"]
-            action = self.temporal_ensembler.update(actions)
-            return action
+            if self._n_steps % self.config.temporal_ensemble_stride == 0:
+                if inputs is None:
+                    inputs = self._prepare_inputs(batch)
+                actions = self._predict_action_chunk(inputs)
+                self.temporal_ensembler.add(actions)
+            self._n_steps += 1
+            return _copy_to_host(self.temporal_ensembler.pop())
+
+        if self.config.prefetch_low_water_mark is not None:
+            self._splice_prefetched_action_chunk()
 
         # Action queue logic for n_action_steps > 1. When the action_queue is depleted, populate it by
         # querying the policy.
         if len(self._action_queue) == 0:
-            actions = self.model(batch)[0][:, : self.config.n_action_steps]
-
-            # TODO(rcadene): make _forward return output dictionary?
-            actions = self.unnormalize_outputs({"action": actions})["action"]
+            if inputs is None:
+                inputs = self._prepare_inputs(batch)
+            actions = _copy_to_host(self._predict_action_chunk(inputs)[:, : self.config.n_action_steps])
 
             # `self.model.forward` returns a (batch_size, n_action_steps, action_dim) tensor, but the queue
             # effectively has shape (n_action_steps, batch_size, *), hence the transpose.
             self._action_queue.extend(actions.transpose(0, 1))
+
+        if self.config.prefetch_low_water_mark is not None:
+            if (
+                self._prefetch_future is None
+                and len(self._action_queue) <= self.config.prefetch_low_water_mark
+            ):
+                self._start_prefetch(batch, inputs)
+            self._n_steps_since_prefetch += 1
         return self._action_queue.popleft()
 
+    def _prepare_inputs(self, batch: dict[str, Tensor]) -> dict[str, Tensor]:
+        """Normalize the inputs, crop and resize the camera images and stack them, as expected by
+        `ACT.forward`."""
+        with self.stage_timer.stage("normalize"):
+            if "observation.image_features" in batch:
+                # The camera images are replaced by their precomputed backbone feature maps.
+                batch = self._normalize_non_image_inputs(batch)
+            else:
+                batch = self.normalize_inputs(batch)
+                if len(self.expected_image_keys) > 0:
+                    batch = dict(batch)  # shallow copy so that adding a key doesn't modify the original
+                    batch["observation.images"] = torch.stack(
+                        [self._crop_and_resize_image(k, batch[k]) for k in self.expected_image_keys], dim=-4
+                    )
+        if "frame_index" in batch:
+            batch["frame_index"] = batch["frame_index"].float()
+        return batch
+
+    def _normalize_non_image_inputs(self, batch: dict[str, Tensor]) -> dict[str, Tensor]:
+        """Same as `self.normalize_inputs`, for a batch without the camera images (which `Normalize`
+        expects)."""
+        batch = dict(batch)
+        keys = [k for k in self.config.input_normalization_modes if k not in self.expected_image_keys]
+        for key, (scale, shift) in self.input_normalization_affine(keys).items():
+            batch[key] = torch.addcmul(shift, batch[key], scale)
+        return batch
+
+    def input_normalization_affine(self, keys: list[str]) -> dict[str, tuple[Tensor, Tensor]]:
+        """For each input key in `keys`, the float32 `scale` and `shift` (on the policy's device) such that
+        `x * scale + shift` is the normalization of `x` by `self.normalize_inputs`. The ones of the camera
+        images have a (C, 1, 1) shape.
+
+        `Normalize` is an element-wise affine transform whatever the normalization mode, so `shift` and
+        `scale` are read off its outputs for all-zeros and all-ones inputs. This is done on a float64 CPU copy
+        of it, so that the difference of the two outputs doesn't lose precision for large statistics.
+        """
+        normalize = copy.deepcopy(self.normalize_inputs).to("cpu", torch.float64)
+        shapes = {
+            key: (shape[0], 1, 1) if key in self.expected_image_keys else tuple(shape)
+            for key, shape in self.config.input_shapes.items()
+        }
+        zeros = normalize({k: torch.zeros(shape, dtype=torch.float64) for k, shape in shapes.items()})
+        ones = normalize({k: torch.ones(shape, dtype=torch.float64) for k, shape in shapes.items()})
+        device = next(self.parameters()).device
+        return {
+            key: ((ones[key] - zeros[key]).to(device, torch.float32), zeros[key].to(device, torch.float32))
+            for key in keys
+        }
+
+    def _crop_and_resize_image(self, key: str, image: Tensor) -> Tensor:
+        """Apply the configured crop and resize of camera `key` to a (*, C, H, W) batch of images."""
+        if key in self.config.image_crops:
+            top, left, height, width = self.config.image_crops[key]
+            image = image[..., top : top + height, left : left + width]
+        if key in self.config.image_resize_shapes:
+            *batch_shape, channels, height, width = image.shape
+            size = tuple(self.config.image_resize_shapes[key])
+            image = F.interpolate(
+                image.reshape(-1, channels, height, width),
+                size=size,
+                mode="bilinear",
+                align_corners=False,
+                antialias=True,
+            ).reshape(*batch_shape, channels, *size)
+        return image
+
+    def _predict_action_chunk(self, batch: dict[str, Tensor]) -> Tensor:
+        """Predict a (batch_size, chunk_size, action_dim) chunk of unnormalized actions from prepared
+        inputs."""
+        if self._inference_backend is not None and not self.training:
+            actions = self._inference_backend(batch)
+        else:
+            if not self.training and not self.model.is_prepared_for_inference:
+                self.model.prepare_for_inference()
+            actions = self.model(batch)[0]
+        with self.stage_timer.stage("unnormalize"):
+            return self.unnormalize_outputs({"action": actions})["action"]
+
+    def _start_prefetch(self, batch: dict[str, Tensor], inputs: dict[str, Tensor] | None = None):
+        """Start predicting the next action chunk from the current observation in a background thread.
+
+        `inputs` are the prepared inputs for `batch`, if they're already available.
+        """
+        if inputs is None:
+            inputs = self._prepare_inputs(batch)
+        # Copy the inputs that were passed through as is, so that the caller is free to reuse its tensors
+        # while the worker runs.
+        inputs = {k: v.clone() if v is batch.get(k) else v for k, v in inputs.items()}
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="act_prefetch")
+        self._prefetch_future = self._prefetch_executor.submit(self._predict_action_chunk_no_grad, inputs)
+        self._n_steps_since_prefetch = 0
+
+    def _predict_action_chunk_no_grad(self, batch: dict[str, Tensor]) -> Tensor:
+        # Grad mode is thread local, so `select_action`'s `no_grad` doesn't apply to the prefetch worker.
+        # The copy to host memory is done here as well, so that its synchronization doesn't block the control
+        # loop either.
+        with torch.no_grad():
+            return _copy_to_host(self._predict_action_chunk(batch))
+
+    def _splice_prefetched_action_chunk(self):
+        """Replace the queued actions with the prefetched chunk once it's ready (or wait for it if the queue
+        is empty).
+
+        The chunk was predicted from the observation `self._n_steps_since_prefetch` steps ago, and its first
+        action is the one for that step. So the actions for the steps that have already been executed are
+        skipped, and the queue resumes at the action for the current step.
+        """
+        if self._prefetch_future is None:
+            return
+        if not self._prefetch_future.done():
+            if len(self._action_queue) > 0:
+                return
+            self.n_prefetch_stalls += 1
+        actions = self._prefetch_future.result()
+        self._prefetch_future = None
+        self._action_queue.clear()
+        self._action_queue.extend(
+            actions[:, self._n_steps_since_prefetch : self.config.n_action_steps].transpose(0, 1)
+        )
+
     def forward(self, batch: dict[str, Tensor]) -> dict[str, Tensor]:
         """Run the batch through the model and compute the loss for training or validation."""
-        batch = self.normalize_inputs(batch)
-        if len(self.expected_image_keys) > 0:
-            batch = dict(batch)  # shallow copy so that adding a key doesn't modify the original
-            batch["observation.images"] = torch.stack([batch[k] for k in self.expected_image_keys], dim=-4)
-        
-        batch['frame_index'] = batch['frame_index'].float().requires_grad_(True)
+        if self.config.inference_only:
+            raise RuntimeError(
+                "This policy was built without its VAE encoder for inference only, so the loss can't be "
+                "computed. Load the full checkpoint instead."
+            )
+        batch = self._prepare_inputs(batch)
+        if self.config.capture_input_gradients:
+            # Track the gradients w.r.t. the inputs for the saliency and phase gradient analyses (see below).
+            for key in ["observation.images", "frame_index"]:
+                if key in batch:
+                    batch[key] = batch[key].detach().requires_grad_(True)
 
         batch = self.normalize_targets(batch)
         actions_hat, (mu_hat, log_sigma_x2_hat) = self.model(batch)
 
+        if self.config.capture_input_gradients:
+            self.diagnostics = {
+                "action_hat": actions_hat,
+                **{k: batch[k] for k in ["observation.images", "frame_index"] if k in batch},
+            }
+
         l1_loss = (
             F.l1_loss(batch["action"], actions_hat, reduction="none") * ~batch["action_is_pad"].unsqueeze(-1)
         ).mean()
 
         loss_dict = {"l1_loss": l1_loss.item()}
+        if "teacher_action" in batch:
+            # Distillation: also regress the (unnormalized) action chunks predicted by the teacher policy.
+            teacher_action = self.normalize_targets({"action": batch["teacher_action"]})["action"]
+            distillation_l1_loss = (
+                F.l1_loss(teacher_action, actions_hat, reduction="none")
+                * ~batch["action_is_pad"].unsqueeze(-1)
+            ).mean()
+            loss_dict["distillation_l1_loss"] = distillation_l1_loss.item()
+            l1_loss = l1_loss + distillation_l1_loss * self.config.distillation_loss_weight
         if self.config.use_vae:
             # Calculate Dₖₗ(latent_pdf || standard_normal). Note: After computing the KL-divergence for
             # each dimension independently, we sum over the latent dimension to get the total
@@ -166,8 +400,7 @@ class ACTPolicy(
         else:
             loss_dict["loss"] = l1_loss
 
-        #code for saliency
-        # batch["observation.images"].requires_grad_(True)  # Enable gradients
+        #code for saliency (requires `config.capture_input_gradients`)
         # actions_hat[0,0,:].sum().backward(retain_graph=True)  # Compute gradients w.r.t. first action
         # saliency_map = batch["observation.images"].grad.abs()  # Extract saliency map
         # saliency_map = saliency_map[0,:,:,:,:]
@@ -177,7 +410,6 @@ class ACTPolicy(
         # global frame_ls
         # global grad_ls
         # global phase_gradient
-        # batch['frame_index'] = batch['frame_index'].float().requires_grad_(True)
         # actions_hat.sum().backward(retain_graph=True)  # Compute gradients w.r.t. first action
         # time_grad = batch["frame_index"].grad.abs()
         # print('>>>','frame: ' ,batch['frame_index'].cpu().tolist(), 'grad: ',time_grad.cpu().tolist())
@@ -231,6 +463,96 @@ class ACTPolicy(
         return loss_dict
 
 
+class ACTLatencyTracker:
+    def __init__(self, window_size: int = 1000):
+        """Keeps the latencies (in seconds) of the last `window_size` calls of a recurring operation.
+
+        Used to monitor the per-step latency of `ACTPolicy.select_action` against the control loop's budget.
+        """
+        self._latencies_s = deque([], maxlen=window_size)
+
+    def __len__(self) -> int:
+        return len(self._latencies_s)
+
+    def reset(self):
+        self._latencies_s.clear()
+
+    def record(self, latency_s: float):
+        self._latencies_s.append(latency_s)
+
+    def summary(self) -> dict[str, float]:
+        """Return the count, mean, median, tail percentiles and max of the recorded latencies (in ms)."""
+        if len(self._latencies_s) == 0:
+            return {"count": 0}
+        latencies_ms = np.array(self._latencies_s) * 1000
+        return {
+            "count": len(latencies_ms),
+            "mean_ms": float(latencies_ms.mean()),
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p95_ms": float(np.percentile(latencies_ms, 95)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "max_ms": float(latencies_ms.max()),
+        }
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class ACTStageTimer:
+    def __init__(self, window_size: int = 1000):
+        """Opt-in wall time measurement of the stages of an ACT inference step.
+
+        Each stage's latencies are kept in an `ACTLatencyTracker` of `window_size`, see `summary`. When
+        disabled (the default), `stage` returns a shared no-op context manager, so the instrumented code only
+        pays for an attribute lookup and a function call. When enabled, the device is synchronized around each
+        stage so that asynchronous (e.g. CUDA) kernels are attributed to the right stage, which slows down the
+        step: only enable it to diagnose latency.
+
+        Stages inside `ACT.forward` are only recorded when the model runs eagerly (not with an inference
+        backend, see `ACTPolicy.set_inference_backend`).
+        """
+        self.window_size = window_size
+        self.enabled = False
+        self.device: torch.device | None = None
+        self.latencies: dict[str, ACTLatencyTracker] = {}
+
+    def enable(self, enabled: bool = True, device: torch.device | None = None):
+        """Start (or stop) recording, synchronizing `device` around each stage."""
+        self.enabled = enabled
+        self.device = device
+
+    def reset(self):
+        self.latencies.clear()
+
+    def stage(self, name: str) -> contextlib.AbstractContextManager:
+        """Context manager recording the wall time of its block as stage `name`."""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._time(name)
+
+    @contextlib.contextmanager
+    def _time(self, name: str):
+        self._synchronize()
+        start = time.perf_counter()
+        yield
+        self._synchronize()
+        if name not in self.latencies:
+            self.latencies[name] = ACTLatencyTracker(self.window_size)
+        self.latencies[name].record(time.perf_counter() - start)
+
+    def _synchronize(self):
+        if self.device is None:
+            return
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        elif self.device.type == "mps":
+            torch.mps.synchronize()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return the latency summary (see `ACTLatencyTracker.summary`) of each recorded stage."""
+        return {name: tracker.summary() for name, tracker in self.latencies.items()}
+
+
 class ACTTemporalEnsembler:
     def __init__(self, temporal_ensemble_coeff: float, chunk_size: int) -> None:
         """Temporal ensembling as described in Algorithm 2 of https://arxiv.org/abs/2304.13705.
@@ -273,52 +595,111 @@ class ACTTemporalEnsembler:
             avg /= exp_weights[:i+1].sum()
         print("online", avg)
         ```
+
+        The running averages live in a preallocated (batch, chunk_size, action_dim) ring buffer, which is
+        updated in place: slot `(self._head + i) % chunk_size` holds the average for the i-th next time step,
+        and consuming an action just moves `self._head` forward.
         """
         self.chunk_size = chunk_size
         self.ensemble_weights = torch.exp(-temporal_ensemble_coeff * torch.arange(chunk_size))
         self.ensemble_weights_cumsum = torch.cumsum(self.ensemble_weights, dim=0)
+        # The cumsum with a leading 0, such that `ensemble_weights_cumsum_padded[n]` is the total weight of an
+        # average over n actions.
+        self.ensemble_weights_cumsum_padded = torch.cat([torch.zeros(1), self.ensemble_weights_cumsum])
+        # Buffers, allocated on the first update (see `_allocate`).
+        self._ensembled_actions: Tensor | None = None
         self.reset()
 
     def reset(self):
         """Resets the online computation variables."""
-        self.ensembled_actions = None
-        # (chunk_size,) count of how many actions are in the ensemble for each time step in the sequence.
-        self.ensembled_actions_count = None
+        # Note: the buffers are kept around to be reused in the next episode.
+        self._is_empty = True
+        self._head = 0
+
+    def _allocate(self, actions: Tensor):
+        device = actions.device
+        self.ensemble_weights = self.ensemble_weights.to(device=device)
+        self.ensemble_weights_cumsum = self.ensemble_weights_cumsum.to(device=device)
+        self.ensemble_weights_cumsum_padded = self.ensemble_weights_cumsum_padded.to(device=device)
+        # (batch, chunk_size, action_dim) running averages, indexed by physical slot.
+        self._ensembled_actions = torch.zeros_like(actions)
+        # (batch, chunk_size, action_dim) incoming actions, rotated to match the physical slots.
+        self._staged_actions = torch.zeros_like(actions)
+        # (chunk_size,) count of how many actions are in the ensemble for each physical slot. A slot that was
+        # just consumed has a count of 0.
+        self._counts = torch.zeros(self.chunk_size, dtype=torch.long, device=device)
+        # (chunk_size, 1) per slot weights gathered for the current update. The last dimension makes sure we
+        # can broadcast properly against the actions.
+        self._old_weights_sum = torch.zeros(self.chunk_size, 1, device=device)
+        self._new_weights = torch.zeros(self.chunk_size, 1, device=device)
+        self._new_weights_sum = torch.zeros(self.chunk_size, 1, device=device)
 
     def update(self, actions: Tensor) -> Tensor:
         """
         Takes a (batch, chunk_size, action_dim) sequence of actions, update the temporal ensemble for all
         time steps, and pop/return the next batch of actions in the sequence.
         """
-        self.ensemble_weights = self.ensemble_weights.to(device=actions.device)
-        self.ensemble_weights_cumsum = self.ensemble_weights_cumsum.to(device=actions.device)
-        if self.ensembled_actions is None:
-            # Initializes `self._ensembled_action` to the sequence of actions predicted during the first
-            # time step of the episode.
-            self.ensembled_actions = actions.clone()
-            # Note: The last dimension is unsqueeze to make sure we can broadcast properly for tensor
-            # operations later.
-            self.ensembled_actions_count = torch.ones(
-                (self.chunk_size, 1), dtype=torch.long, device=self.ensembled_actions.device
-            )
+        self.add(actions)
+        return self.pop()
+
+    def add(self, actions: Tensor):
+        """Update the temporal ensemble with a (batch, chunk_size, action_dim) sequence of actions, whose
+        first action is for the current time step.
+
+        Time steps for which no action was added since they were last popped (see `pop`) just get the new
+        actions.
+        """
+        if (
+            self._ensembled_actions is None
+            or self._ensembled_actions.shape != actions.shape
+            or self._ensembled_actions.dtype != actions.dtype
+            or self._ensembled_actions.device != actions.device
+        ):
+            self._allocate(actions)
+            self._is_empty = True
+
+        if self._is_empty:
+            # Initializes the ensemble to the sequence of actions predicted during the first time step of the
+            # episode.
+            self._ensembled_actions.copy_(actions)
+            self._counts.fill_(1)
+            self._head = 0
+            self._is_empty = False
         else:
-            # self.ensembled_actions will have shape (batch_size, chunk_size - 1, action_dim). Compute
-            # the online update for those entries.
-            self.ensembled_actions *= self.ensemble_weights_cumsum[self.ensembled_actions_count - 1]
-            self.ensembled_actions += actions[:, :-1] * self.ensemble_weights[self.ensembled_actions_count]
-            self.ensembled_actions /= self.ensemble_weights_cumsum[self.ensembled_actions_count]
-            self.ensembled_actions_count = torch.clamp(self.ensembled_actions_count + 1, max=self.chunk_size)
-            # The last action, which has no prior online average, needs to get concatenated onto the end.
-            self.ensembled_actions = torch.cat([self.ensembled_actions, actions[:, -1:]], dim=1)
-            self.ensembled_actions_count = torch.cat(
-                [self.ensembled_actions_count, torch.ones_like(self.ensembled_actions_count[-1:])]
+            # Rotate the actions so that the i-th action lands in the slot of the i-th next time step.
+            head = self._head
+            self._staged_actions[:, head:].copy_(actions[:, : self.chunk_size - head])
+            self._staged_actions[:, :head].copy_(actions[:, self.chunk_size - head :])
+            # Online update of the averages. The slot consumed in the last step has a count of 0 and holds
+            # zeros, so it just gets the new (last) action, which has no prior online average.
+            torch.index_select(
+                self.ensemble_weights_cumsum_padded, 0, self._counts, out=self._old_weights_sum.view(-1)
             )
-        # "Consume" the first action.
-        action, self.ensembled_actions, self.ensembled_actions_count = (
-            self.ensembled_actions[:, 0],
-            self.ensembled_actions[:, 1:],
-            self.ensembled_actions_count[1:],
-        )
+            torch.index_select(self.ensemble_weights, 0, self._counts, out=self._new_weights.view(-1))
+            self._counts.add_(1)
+            torch.index_select(
+                self.ensemble_weights_cumsum_padded, 0, self._counts, out=self._new_weights_sum.view(-1)
+            )
+            self._ensembled_actions.mul_(self._old_weights_sum)
+            self._ensembled_actions.add_(self._staged_actions.mul_(self._new_weights))
+            self._ensembled_actions.div_(self._new_weights_sum)
+
+    def pop(self) -> Tensor:
+        """Pop/return the (batch, action_dim) ensembled action for the current time step, without adding a new
+        sequence of actions.
+
+        This can be called up to `chunk_size` times in a row after `add`.
+        """
+        if self._is_empty or self._counts[self._head] == 0:
+            raise RuntimeError(
+                "The temporal ensemble holds no action for the current time step. `add` must be called at "
+                "least once every `chunk_size` steps."
+            )
+        # "Consume" the first action and free its slot for the last action of the next update.
+        action = self._ensembled_actions[:, self._head].clone()
+        self._ensembled_actions[:, self._head].zero_()
+        self._counts[self._head] = 0
+        self._head = (self._head + 1) % self.chunk_size
         return action
 
 
@@ -357,6 +738,9 @@ class ACT(nn.Module):
                                 └───────────────────────┘
     """
 
+    # Names of the buffers set by `prepare_for_inference`.
+    _INFERENCE_CONSTANTS = ("_latent_token", "_encoder_1d_pos_embed", "_decoder_in", "_decoder_pos_embed")
+
     def __init__(self, config: ACTConfig):
         super().__init__()
         self.config = config
@@ -365,7 +749,10 @@ class ACT(nn.Module):
         self.use_robot_state = "observation.state" in config.input_shapes
         self.use_images = any(k.startswith("observation.image") for k in config.input_shapes)
         self.use_env_state = "observation.environment_state" in config.input_shapes
-        if self.config.use_vae:
+        # Note: The VAE encoder is never used at inference time (the latent is set to zeros), so it is left
+        # out of inference-only models.
+        self.use_vae_encoder = config.use_vae and not config.inference_only
+        if self.use_vae_encoder:
             self.vae_encoder = ACTEncoder(config, is_vae_encoder=True)
             self.vae_encoder_cls_embed = nn.Embedding(1, config.dim_model)
             # Projection layer for joint-space configuration to hidden dimension.
@@ -391,15 +778,10 @@ class ACT(nn.Module):
 
         # Backbone for image feature extraction.
         if self.use_images:
-            backbone_model = getattr(torchvision.models, config.vision_backbone)(
-                replace_stride_with_dilation=[False, False, config.replace_final_stride_with_dilation],
-                weights=config.pretrained_backbone_weights,
-                norm_layer=FrozenBatchNorm2d,
-            )
-            # Note: The assumption here is that we are using a ResNet model (and hence layer4 is the final
-            # feature map).
             # Note: The forward method of this returns a dict: {"feature_map": output}.
-            self.backbone = IntermediateLayerGetter(backbone_model, return_layers={"layer4": "feature_map"})
+            self.backbone, backbone_out_channels = make_backbone(config)
+            if config.freeze_backbone:
+                self.backbone.requires_grad_(False)
 
         # Transformer (acts as VAE decoder when training with the variational objective).
         self.encoder = ACTEncoder(config)
@@ -418,7 +800,10 @@ class ACT(nn.Module):
         self.encoder_latent_input_proj = nn.Linear(config.latent_dim, config.dim_model)
         if self.use_images:
             self.encoder_img_feat_input_proj = nn.Conv2d(
-                backbone_model.fc.in_features, config.dim_model, kernel_size=1
+                backbone_out_channels, config.dim_model, kernel_size=1
+            )
+            self.image_token_reducer = (
+                ACTImageTokenReducer(config) if config.image_token_reduction is not None else None
             )
 
         # Transformer encoder positional embeddings.
@@ -447,6 +832,17 @@ class ACT(nn.Module):
         # Final action regression head on the output of the transformer's decoder.
         self.action_head = nn.Linear(config.dim_model, config.output_shapes["action"][0])
 
+        # Per-stage latencies, off by default (see `ACTStageTimer`).
+        self.stage_timer = ACTStageTimer()
+
+        # Inference constants, see `prepare_for_inference`. They are not part of the state dict.
+        for name in self._INFERENCE_CONSTANTS:
+            self.register_buffer(name, None, persistent=False)
+        # Positional embeddings of all the encoder tokens at inference time, per (n_cameras, h, w, device,
+        # dtype) of the camera feature maps (see `_encoder_pos_embed`). Cleared along with the constants.
+        self._encoder_pos_embed_cache: dict[tuple, Tensor] = {}
+        self.register_load_state_dict_post_hook(lambda module, _: module.clear_inference_constants())
+
         self._reset_parameters()
 
     def _reset_parameters(self):
@@ -455,6 +851,104 @@ class ACT(nn.Module):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
+    @property
+    def is_prepared_for_inference(self) -> bool:
+        return self._decoder_in is not None
+
+    def prepare_for_inference(self):
+        """Precompute the tokens that don't depend on the inputs at inference time, and use them in `forward`
+        until the next call to `train()` or `load_state_dict`.
+
+        Those are the latent token (the projection of the all-zeros latent), the positional embeddings of the
+        1D encoder tokens and of the decoder queries, and the all-zeros decoder input. They are stored as
+        non-persistent buffers, so they follow the model across devices and dtypes. The positional embeddings
+        of all the encoder tokens (1D and camera tokens) are then cached per camera feature map shape on first
+        use. Call this again after modifying the weights in place in eval mode.
+        """
+        # Like the 2D positional embeddings, these are reused outside of any `inference_mode` they're made in.
+        with torch.inference_mode(False), torch.no_grad():
+            latent = torch.zeros(1, self.config.latent_dim, device=self.decoder_pos_embed.weight.device)
+            self._latent_token = self.encoder_latent_input_proj(latent)  # (1, D)
+            self._encoder_1d_pos_embed = self.encoder_1d_feature_pos_embed.weight.unsqueeze(1).clone()
+            self._decoder_pos_embed = self.decoder_pos_embed.weight.unsqueeze(1).clone()
+            self._decoder_in = torch.zeros_like(self._decoder_pos_embed)  # (chunk_size, 1, D)
+
+    def clear_inference_constants(self):
+        """Drop the tokens precomputed by `prepare_for_inference`."""
+        for name in self._INFERENCE_CONSTANTS:
+            setattr(self, name, None)
+        self._encoder_pos_embed_cache.clear()
+
+    def train(self, mode: bool = True):
+        if mode:
+            # The weights are about to change.
+            self.clear_inference_constants()
+        super().train(mode)
+        if self.use_images and self.config.freeze_backbone:
+            self.backbone.eval()
+        return self
+
+    def _backbone_features(self, images: Tensor) -> Tensor:
+        """Run the vision backbone, with activation checkpointing per block if configured (in training)."""
+        if not (
+            "backbone" in self.config.activation_checkpointing and self.training and torch.is_grad_enabled()
+        ):
+            return self.backbone(images)["feature_map"]
+        # `IntermediateLayerGetter` runs its children in sequence, up to the returned (last) one. They are
+        # checkpointed block by block, except for consecutive layers without submodules (e.g. the conv, norm,
+        # in-place ReLU and pooling of the ResNet stem) which form a single segment: an in-place activation
+        # on its own would modify the saved input of the previous segment.
+        segments, layers = [], []
+        for child in self.backbone.values():
+            if next(child.children(), None) is None:
+                layers.append(child)
+                continue
+            if layers:
+                segments.append(nn.Sequential(*layers))
+                layers = []
+            if isinstance(child, nn.Sequential) and all(next(c.children(), None) is not None for c in child):
+                segments.extend(child)
+            else:
+                segments.append(child)
+        if layers:
+            segments.append(nn.Sequential(*layers))
+        x = images
+        for segment in segments:
+            x = torch.utils.checkpoint.checkpoint(segment, x, use_reentrant=False)
+        return x
+
+    def _encoder_pos_embed(
+        self,
+        pos_embed_1d: Tensor,
+        cam_features: Tensor,
+        n_cameras: int,
+        cam_pos_embed: Tensor | None = None,
+        cache: bool = False,
+    ) -> Tensor:
+        """Stack the (n_1d_tokens, 1, D) positional embeddings of the 1D tokens and the ones of the camera
+        tokens along the sequence dimension.
+
+        `cam_pos_embed` are the positional embeddings of the camera tokens, or None for the ones of all the
+        pixels of `cam_features` (the (B, C, h, n_cameras * w) feature maps). With `cache`, the stack is
+        reused for feature maps of the same shape, device and dtype until `clear_inference_constants`, as it
+        depends on the 1D positional embedding weights.
+        """
+        key = (n_cameras, *cam_features.shape[-2:], cam_features.device, cam_features.dtype)
+        if cache and key in self._encoder_pos_embed_cache:
+            return self._encoder_pos_embed_cache[key]
+        if cam_pos_embed is None:
+            # These only depend on the feature map shape, so they come from a cache.
+            cam_pos_embed = self.encoder_cam_feat_pos_embed.tokens(cam_features, n_cameras)
+        if cam_pos_embed.shape[1] != pos_embed_1d.shape[1]:
+            pos_embed_1d = pos_embed_1d.expand(-1, cam_pos_embed.shape[1], -1)
+        if not cache:
+            return torch.cat([pos_embed_1d, cam_pos_embed], axis=0)
+        # Like the other inference constants, this is reused outside of any `inference_mode` it's made in.
+        with torch.inference_mode(False), torch.no_grad():
+            pos_embed = torch.cat([pos_embed_1d, cam_pos_embed], axis=0)
+        self._encoder_pos_embed_cache[key] = pos_embed
+        return pos_embed
+
     def forward(self, batch: dict[str, Tensor]) -> tuple[Tensor, tuple[Tensor, Tensor] | tuple[None, None]]:
         """A forward pass through the Action Chunking Transformer (with optional VAE encoder).
 
@@ -463,6 +957,9 @@ class ACT(nn.Module):
             "observation.state" (optional): (B, state_dim) batch of robot states.
 
             "observation.images": (B, n_cameras, C, H, W) batch of images.
+                OR
+            "observation.image_features": (B, n_cameras, C', h, w) batch of precomputed backbone feature maps
+                (see `lerobot.common.policies.act.feature_cache_act`).
                 AND/OR
             "observation.environment_state": (B, env_dim) batch of environment states.
 
@@ -474,19 +971,22 @@ class ACT(nn.Module):
             Tuple containing the latent PDF's parameters (mean, log(σ²)) both as (B, L) tensors where L is the
             latent dimension.
         """
+        if self.config.inference_only and self.training:
+            raise RuntimeError("Inference-only models don't have a VAE encoder and can't be trained.")
         if self.config.use_vae and self.training:
             assert (
                 "action" in batch
             ), "actions must be provided when using the variational objective in training mode."
 
+        image_key = (
+            "observation.image_features" if "observation.image_features" in batch else "observation.images"
+        )
         batch_size = (
-            batch["observation.images"]
-            if "observation.images" in batch
-            else batch["observation.environment_state"]
+            batch[image_key] if image_key in batch else batch["observation.environment_state"]
         ).shape[0]
 
         # Prepare the latent for input to the transformer encoder.
-        if self.config.use_vae and "action" in batch:
+        if self.use_vae_encoder and "action" in batch:
             # Prepare the input to the VAE encoder: [cls, *joint_space_configuration, *action_sequence].
             cls_embed = einops.repeat(
                 self.vae_encoder_cls_embed.weight, "1 d -> b 1 d", b=batch_size
@@ -534,14 +1034,20 @@ class ACT(nn.Module):
         else:
             # When not using the VAE encoder, we set the latent to be all zeros.
             mu = log_sigma_x2 = None
-            # TODO(rcadene, alexander-soare): remove call to `.to` to speedup forward ; precompute and use buffer
+            latent_sample = None
+        # Use the precomputed inference constants if any (see `prepare_for_inference`).
+        use_constants = self.is_prepared_for_inference and not self.training
+
+        # Prepare transformer encoder inputs.
+        if latent_sample is not None:
+            encoder_in_tokens = [self.encoder_latent_input_proj(latent_sample)]
+        elif use_constants:
+            encoder_in_tokens = [self._latent_token.expand(batch_size, -1)]
+        else:
             latent_sample = torch.zeros([batch_size, self.config.latent_dim], dtype=torch.float32).to(
                 batch["observation.state"].device
             )
-
-        # Prepare transformer encoder inputs.
-        encoder_in_tokens = [self.encoder_latent_input_proj(latent_sample)]
-        encoder_in_pos_embed = list(self.encoder_1d_feature_pos_embed.weight.unsqueeze(1))
+            encoder_in_tokens = [self.encoder_latent_input_proj(latent_sample)]
         # Robot state token.
         if self.use_robot_state:
             encoder_in_tokens.append(self.encoder_robot_state_input_proj(batch["observation.state"]))
@@ -557,54 +1063,251 @@ class ACT(nn.Module):
             encoder_in_tokens.append(self.time_embed_proj(frame_index_normalized))    
             #print("==>"+str(batch['frame_index'].item()))
 
+        # Stack the 1D tokens along the sequence dimension.
+        encoder_in_tokens = torch.stack(encoder_in_tokens, axis=0)  # (n_1d_tokens, B, D)
+        if use_constants:
+            encoder_in_pos_embed = self._encoder_1d_pos_embed
+        else:
+            # (n_1d_tokens, 1, D)
+            encoder_in_pos_embed = self.encoder_1d_feature_pos_embed.weight.unsqueeze(1)
+
         # Camera observation features and positional embeddings.
         if self.use_images:
-            all_cam_features = []
-            all_cam_pos_embeds = []
-            batch["observation.images"] = batch["observation.images"].requires_grad_(True)
-
-            for cam_index in range(batch["observation.images"].shape[-4]):
-                cam_features = self.backbone(batch["observation.images"][:, cam_index])["feature_map"]
-                # TODO(rcadene, alexander-soare): remove call to `.to` to speedup forward ; precompute and use
-                # buffer
-                cam_pos_embed = self.encoder_cam_feat_pos_embed(cam_features).to(dtype=cam_features.dtype)
-                cam_features = self.encoder_img_feat_input_proj(cam_features)  # (B, C, h, w)
-                all_cam_features.append(cam_features)
-                all_cam_pos_embeds.append(cam_pos_embed)
-            # Concatenate camera observation feature maps and positional embeddings along the width dimension,
-            # and move to (sequence, batch, dim).
-            all_cam_features = torch.cat(all_cam_features, axis=-1)
-            encoder_in_tokens.extend(einops.rearrange(all_cam_features, "b c h w -> (h w) b c"))
-            all_cam_pos_embeds = torch.cat(all_cam_pos_embeds, axis=-1)
-            encoder_in_pos_embed.extend(einops.rearrange(all_cam_pos_embeds, "b c h w -> (h w) b c"))
-
-        # Stack all tokens along the sequence dimension.
-        encoder_in_tokens = torch.stack(encoder_in_tokens, axis=0)
-        encoder_in_pos_embed = torch.stack(encoder_in_pos_embed, axis=0)
+            n_cameras = batch[image_key].shape[-4]
+
+            if image_key == "observation.image_features":
+                # The backbone feature maps are precomputed (and may be stored in a lower precision).
+                cam_features = einops.rearrange(batch[image_key], "b n c h w -> (b n) c h w")
+                cam_features = cam_features.to(self.encoder_img_feat_input_proj.weight.dtype)
+                with self.stage_timer.stage("input_projection"):
+                    cam_features = self.encoder_img_feat_input_proj(cam_features)  # (B * N, C, h, w)
+                all_cam_features = einops.rearrange(
+                    cam_features, "(b n) c h w -> b c h (n w)", n=n_cameras
+                )
+            elif self.config.batch_cameras_in_backbone:
+                # Fold the camera axis into the batch axis so that the backbone and the input projection each
+                # run once for all cameras, then unfold the cameras along the width dimension.
+                images = einops.rearrange(batch["observation.images"], "b n c h w -> (b n) c h w")
+                with self.stage_timer.stage("backbone"):
+                    cam_features = self._backbone_features(images)
+                with self.stage_timer.stage("input_projection"):
+                    cam_features = self.encoder_img_feat_input_proj(cam_features)  # (B * N, C, h, w)
+                all_cam_features = einops.rearrange(
+                    cam_features, "(b n) c h w -> b c h (n w)", n=n_cameras
+                )
+            else:
+                all_cam_features = []
+                for cam_index in range(n_cameras):
+                    with self.stage_timer.stage(f"backbone.camera{cam_index}"):
+                        cam_features = self._backbone_features(batch["observation.images"][:, cam_index])
+                    with self.stage_timer.stage(f"input_projection.camera{cam_index}"):
+                        cam_features = self.encoder_img_feat_input_proj(cam_features)  # (B, C, h, w)
+                    all_cam_features.append(cam_features)
+                # Concatenate camera observation feature maps along the width dimension.
+                all_cam_features = torch.cat(all_cam_features, axis=-1)
+            if self.image_token_reducer is None:
+                # Move to (sequence, batch, dim).
+                cam_tokens = einops.rearrange(all_cam_features, "b c h w -> (h w) b c")
+                cam_pos_embed = None
+            else:
+                cam_tokens, cam_pos_embed = self.image_token_reducer(
+                    all_cam_features, n_cameras, self.encoder_cam_feat_pos_embed
+                )
+            # Append the camera tokens to the 1D tokens.
+            encoder_in_tokens = torch.cat([encoder_in_tokens, cam_tokens], axis=0)
+            encoder_in_pos_embed = self._encoder_pos_embed(
+                encoder_in_pos_embed,
+                all_cam_features,
+                n_cameras,
+                cam_pos_embed,
+                # The kept tokens of "topk", hence their positional embeddings, differ across inputs.
+                cache=use_constants and self.config.image_token_reduction != "topk",
+            )
 
         # Forward pass through the transformer modules.
-        encoder_out = self.encoder(encoder_in_tokens, pos_embed=encoder_in_pos_embed)
-        # TODO(rcadene, alexander-soare): remove call to `device` ; precompute and use buffer
-        decoder_in = torch.zeros(
-            (self.config.chunk_size, batch_size, self.config.dim_model),
-            dtype=encoder_in_pos_embed.dtype,
-            device=encoder_in_pos_embed.device,
-        )
-        decoder_out = self.decoder(
-            decoder_in,
-            encoder_out,
-            encoder_pos_embed=encoder_in_pos_embed,
-            decoder_pos_embed=self.decoder_pos_embed.weight.unsqueeze(1),
-        )
+        with self.stage_timer.stage("encoder"):
+            encoder_out = self.encoder(encoder_in_tokens, pos_embed=encoder_in_pos_embed)
+        if use_constants:
+            decoder_in = self._decoder_in.expand(-1, batch_size, -1)
+            decoder_pos_embed = self._decoder_pos_embed
+        else:
+            decoder_in = torch.zeros(
+                (self.config.chunk_size, batch_size, self.config.dim_model),
+                dtype=encoder_in_pos_embed.dtype,
+                device=encoder_in_pos_embed.device,
+            )
+            decoder_pos_embed = self.decoder_pos_embed.weight.unsqueeze(1)
+        with self.stage_timer.stage("decoder"):
+            decoder_out = self.decoder(
+                decoder_in,
+                encoder_out,
+                encoder_pos_embed=encoder_in_pos_embed,
+                decoder_pos_embed=decoder_pos_embed,
+                n_layers=None if self.training else self.config.decoder_exit_layer,
+            )
 
         # Move back to (B, S, C).
         decoder_out = decoder_out.transpose(0, 1)
 
-        actions = self.action_head(decoder_out)
+        with self.stage_timer.stage("head"):
+            actions = self.action_head(decoder_out)
 
         return actions, (mu, log_sigma_x2)
 
 
+class ACTAttention(nn.Module):
+    """Multi-head attention built on `F.scaled_dot_product_attention`, a drop-in for `nn.MultiheadAttention`.
+
+    It has the same parameters (`in_proj_weight`, `in_proj_bias` and `out_proj`) so that checkpoints trained
+    with either backend can be loaded in the other, and the same call signature for the subset of it used in
+    ACT.
+    Inputs are (Sequence, Batch, Channel) tensors.
+
+    In ACT, the query and key are often the same tensor (features + positional embedding), in which case their
+    projections are fused into a single matmul (and likewise for the value when there's no positional
+    embedding).
+    """
+
+    def __init__(self, embed_dim: int, num_heads: int, dropout: float = 0.0):
+        super().__init__()
+        if embed_dim % num_heads != 0:
+            raise ValueError(f"`embed_dim` ({embed_dim}) must be divisible by `num_heads` ({num_heads}).")
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.head_dim = embed_dim // num_heads
+        self.dropout = dropout
+        self.in_proj_weight = nn.Parameter(torch.empty(3 * embed_dim, embed_dim))
+        self.in_proj_bias = nn.Parameter(torch.empty(3 * embed_dim))
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+        # Separate input projections, only set by `split_in_proj`.
+        self.q_proj: nn.Module | None = None
+        self.k_proj: nn.Module | None = None
+        self.v_proj: nn.Module | None = None
+        self._reset_parameters()
+
+    def _reset_parameters(self):
+        # Same initialization as `nn.MultiheadAttention`.
+        nn.init.xavier_uniform_(self.in_proj_weight)
+        nn.init.constant_(self.in_proj_bias, 0.0)
+        nn.init.constant_(self.out_proj.bias, 0.0)
+
+    def split_in_proj(self):
+        """Replace the packed input projection by separate `q_proj`, `k_proj` and `v_proj` linear layers.
+
+        This is meant for module level transforms that only apply to `nn.Linear` layers (like dynamic
+        quantization). The fusion of the query and key projections is lost in the process.
+        """
+        if self.q_proj is not None:
+            return
+        d = self.embed_dim
+        for i, name in enumerate(["q_proj", "k_proj", "v_proj"]):
+            proj = nn.Linear(d, d, device=self.in_proj_weight.device, dtype=self.in_proj_weight.dtype)
+            with torch.no_grad():
+                proj.weight.copy_(self.in_proj_weight[i * d : (i + 1) * d])
+                proj.bias.copy_(self.in_proj_bias[i * d : (i + 1) * d])
+            setattr(self, name, proj)
+        del self.in_proj_weight
+        del self.in_proj_bias
+
+    def _in_proj(self, x: Tensor, start: int, end: int) -> Tensor:
+        """Project `x` with the rows [start, end) of the packed in-projection, in units of `embed_dim`."""
+        d = self.embed_dim
+        return F.linear(x, self.in_proj_weight[start * d : end * d], self.in_proj_bias[start * d : end * d])
+
+    def _split_heads(self, x: Tensor) -> Tensor:
+        """(S, B, C) -> (B, n_heads, S, head_dim)"""
+        return x.view(x.shape[0], x.shape[1], self.num_heads, self.head_dim).permute(1, 2, 0, 3)
+
+    def forward(
+        self, query: Tensor, key: Tensor, value: Tensor, key_padding_mask: Tensor | None = None
+    ) -> tuple[Tensor, None]:
+        """
+        Args:
+            query: (Target Sequence, Batch, Channel) tensor of queries.
+            key: (Source Sequence, B, C) tensor of keys.
+            value: (SS, B, C) tensor of values.
+            key_padding_mask: Optional (B, SS) boolean mask where True means the key is ignored (padding).
+        Returns:
+            A ((TS, B, C) output, None) tuple. The second element stands for the attention weights returned by
+            `nn.MultiheadAttention`, which are not computed here.
+        """
+        if self.q_proj is not None:
+            q, k, v = self.q_proj(query), self.k_proj(key), self.v_proj(value)
+        elif query is key and key is value:
+            q, k, v = self._in_proj(query, 0, 3).chunk(3, dim=-1)
+        elif query is key:
+            q, k = self._in_proj(query, 0, 2).chunk(2, dim=-1)
+            v = self._in_proj(value, 2, 3)
+        else:
+            q = self._in_proj(query, 0, 1)
+            k = self._in_proj(key, 1, 2)
+            v = self._in_proj(value, 2, 3)
+
+        attn_mask = None
+        if key_padding_mask is not None:
+            # SDPA's boolean masks are True where attention is allowed. (B, SS) -> (B, 1, 1, SS)
+            attn_mask = ~key_padding_mask[:, None, None, :]
+        x = F.scaled_dot_product_attention(
+            self._split_heads(q),
+            self._split_heads(k),
+            self._split_heads(v),
+            attn_mask=attn_mask,
+            dropout_p=self.dropout if self.training else 0.0,
+        )  # (B, n_heads, TS, head_dim)
+        x = x.permute(2, 0, 1, 3).reshape(query.shape[0], query.shape[1], self.embed_dim)
+        return self.out_proj(x), None
+
+
+def make_backbone(config: ACTConfig) -> tuple[nn.Module, int]:
+    """Build the torchvision vision backbone named by `config.vision_backbone`.
+
+    Returns the backbone, whose forward method returns its final feature map as {"feature_map": output}, and
+    the number of channels of that feature map. The batch norm layers are frozen (see `FrozenBatchNorm2d`).
+    """
+    backbone_cls = getattr(torchvision.models, config.vision_backbone)
+    if config.vision_backbone.startswith("resnet"):
+        backbone_model = backbone_cls(
+            replace_stride_with_dilation=[False, False, config.replace_final_stride_with_dilation],
+            weights=config.pretrained_backbone_weights,
+            norm_layer=FrozenBatchNorm2d,
+        )
+        # layer4 is the final feature map of the ResNets.
+        backbone = IntermediateLayerGetter(backbone_model, return_layers={"layer4": "feature_map"})
+        return backbone, backbone_model.fc.in_features
+
+    # Some of the torchvision builders set their own batch norm epsilon, so the batch norm layers are frozen
+    # after the fact rather than by passing `norm_layer`.
+    backbone_model = _freeze_batch_norm(backbone_cls(weights=config.pretrained_backbone_weights))
+    # The final feature map is the output of `trunk_output` for the RegNets and of `features` for the
+    # MobileNets and EfficientNets.
+    return_layer = "trunk_output" if config.vision_backbone.startswith("regnet") else "features"
+    backbone = IntermediateLayerGetter(backbone_model, return_layers={return_layer: "feature_map"})
+    # The number of channels isn't exposed consistently across these models, so get it from a dry run.
+    with torch.no_grad():
+        out_channels = backbone(torch.zeros(1, 3, 64, 64))["feature_map"].shape[1]
+    return backbone, out_channels
+
+
+def _freeze_batch_norm(module: nn.Module) -> nn.Module:
+    """Replace the `nn.BatchNorm2d` layers of `module` (in place) with `FrozenBatchNorm2d` layers holding the
+    same statistics, affine parameters and epsilon."""
+    for name, child in module.named_children():
+        if isinstance(child, nn.BatchNorm2d):
+            frozen = FrozenBatchNorm2d(child.num_features, eps=child.eps)
+            frozen.load_state_dict(child.state_dict())
+            setattr(module, name, frozen)
+        else:
+            _freeze_batch_norm(child)
+    return module
+
+
+def make_attention(config: ACTConfig) -> nn.Module:
+    """Make a multi-head attention module for the transformer layers, with the backend set in the config."""
+    if config.attention_backend == "sdpa":
+        return ACTAttention(config.dim_model, config.n_heads, dropout=config.dropout)
+    return nn.MultiheadAttention(config.dim_model, config.n_heads, dropout=config.dropout)
+
+
 class ACTEncoder(nn.Module):
     """Convenience module for running multiple encoder layers, maybe followed by normalization."""
 
@@ -614,12 +1317,21 @@ class ACTEncoder(nn.Module):
         num_layers = config.n_vae_encoder_layers if self.is_vae_encoder else config.n_encoder_layers
         self.layers = nn.ModuleList([ACTEncoderLayer(config) for _ in range(num_layers)])
         self.norm = nn.LayerNorm(config.dim_model) if config.pre_norm else nn.Identity()
+        self.activation_checkpointing = (
+            "vae_encoder" if is_vae_encoder else "encoder"
+        ) in config.activation_checkpointing
 
     def forward(
         self, x: Tensor, pos_embed: Tensor | None = None, key_padding_mask: Tensor | None = None
     ) -> Tensor:
+        checkpoint = self.activation_checkpointing and self.training and torch.is_grad_enabled()
         for layer in self.layers:
-            x = layer(x, pos_embed=pos_embed, key_padding_mask=key_padding_mask)
+            if checkpoint:
+                x = torch.utils.checkpoint.checkpoint(
+                    layer, x, pos_embed=pos_embed, key_padding_mask=key_padding_mask, use_reentrant=False
+                )
+            else:
+                x = layer(x, pos_embed=pos_embed, key_padding_mask=key_padding_mask)
         x = self.norm(x)
         return x
 
@@ -627,7 +1339,7 @@ class ACTEncoder(nn.Module):
 class ACTEncoderLayer(nn.Module):
     def __init__(self, config: ACTConfig):
         super().__init__()
-        self.self_attn = nn.MultiheadAttention(config.dim_model, config.n_heads, dropout=config.dropout)
+        self.self_attn = make_attention(config)
 
         # Feed forward layers.
         self.linear1 = nn.Linear(config.dim_model, config.dim_feedforward)
@@ -669,6 +1381,7 @@ class ACTDecoder(nn.Module):
         super().__init__()
         self.layers = nn.ModuleList([ACTDecoderLayer(config) for _ in range(config.n_decoder_layers)])
         self.norm = nn.LayerNorm(config.dim_model)
+        self.activation_checkpointing = "decoder" in config.activation_checkpointing
 
     def forward(
         self,
@@ -676,11 +1389,24 @@ class ACTDecoder(nn.Module):
         encoder_out: Tensor,
         decoder_pos_embed: Tensor | None = None,
         encoder_pos_embed: Tensor | None = None,
+        n_layers: int | None = None,
     ) -> Tensor:
-        for layer in self.layers:
-            x = layer(
-                x, encoder_out, decoder_pos_embed=decoder_pos_embed, encoder_pos_embed=encoder_pos_embed
-            )
+        """Run the first `n_layers` decoder layers (all of them if None), followed by the final norm."""
+        checkpoint = self.activation_checkpointing and self.training and torch.is_grad_enabled()
+        for layer in self.layers[:n_layers]:
+            if checkpoint:
+                x = torch.utils.checkpoint.checkpoint(
+                    layer,
+                    x,
+                    encoder_out,
+                    decoder_pos_embed=decoder_pos_embed,
+                    encoder_pos_embed=encoder_pos_embed,
+                    use_reentrant=False,
+                )
+            else:
+                x = layer(
+                    x, encoder_out, decoder_pos_embed=decoder_pos_embed, encoder_pos_embed=encoder_pos_embed
+                )
         if self.norm is not None:
             x = self.norm(x)
         return x
@@ -689,8 +1415,8 @@ class ACTDecoder(nn.Module):
 class ACTDecoderLayer(nn.Module):
     def __init__(self, config: ACTConfig):
         super().__init__()
-        self.self_attn = nn.MultiheadAttention(config.dim_model, config.n_heads, dropout=config.dropout)
-        self.multihead_attn = nn.MultiheadAttention(config.dim_model, config.n_heads, dropout=config.dropout)
+        self.self_attn = make_attention(config)
+        self.multihead_attn = make_attention(config)
 
         # Feed forward layers.
         self.linear1 = nn.Linear(config.dim_model, config.dim_feedforward)
@@ -766,14 +1492,19 @@ def create_sinusoidal_pos_embedding(num_positions: int, dimension: int) -> Tenso
     Returns: (num_positions, dimension) position embeddings (the first dimension is the batch dimension).
 
     """
+    # Clone so that callers can't modify the cached table in-place (e.g. when it is registered as a buffer).
+    return _create_sinusoidal_pos_embedding(num_positions, dimension).clone()
 
-    def get_position_angle_vec(position):
-        return [position / np.power(10000, 2 * (hid_j // 2) / dimension) for hid_j in range(dimension)]
 
-    sinusoid_table = np.array([get_position_angle_vec(pos_i) for pos_i in range(num_positions)])
-    sinusoid_table[:, 0::2] = np.sin(sinusoid_table[:, 0::2])  # dim 2i
-    sinusoid_table[:, 1::2] = np.cos(sinusoid_table[:, 1::2])  # dim 2i+1
-    return torch.from_numpy(sinusoid_table).float()
+@functools.lru_cache(maxsize=16)
+def _create_sinusoidal_pos_embedding(num_positions: int, dimension: int) -> Tensor:
+    # Computed in float64 to match the original numpy implementation before casting to float32.
+    position = torch.arange(num_positions, dtype=torch.float64).unsqueeze(1)  # (num_positions, 1)
+    hid = torch.arange(dimension, dtype=torch.float64)
+    sinusoid_table = position / torch.pow(10000, 2 * torch.div(hid, 2, rounding_mode="floor") / dimension)
+    sinusoid_table[:, 0::2] = torch.sin(sinusoid_table[:, 0::2])  # dim 2i
+    sinusoid_table[:, 1::2] = torch.cos(sinusoid_table[:, 1::2])  # dim 2i+1
+    return sinusoid_table.float()
 
 
 class ACTSinusoidalPositionEmbedding2d(nn.Module):
@@ -781,12 +1512,17 @@ class ACTSinusoidalPositionEmbedding2d(nn.Module):
 
     The variation is that the position indices are normalized in [0, 2π] (not quite: the lower bound is 1/H
     for the vertical direction, and 1/W for the horizontal direction.
+
+    The embeddings only depend on the feature map's shape, so they are cached per (H, W, device, dtype) (and
+    per number of cameras for `tokens`). The least recently used entries are evicted once there are more than
+    `cache_size` of them.
     """
 
-    def __init__(self, dimension: int):
+    def __init__(self, dimension: int, cache_size: int = 8):
         """
         Args:
             dimension: The desired dimension of the embeddings.
+            cache_size: The maximum number of embedding tables to keep around.
         """
         super().__init__()
         self.dimension = dimension
@@ -794,6 +1530,8 @@ class ACTSinusoidalPositionEmbedding2d(nn.Module):
         self._eps = 1e-6
         # Inverse "common ratio" for the geometric progression in sinusoid frequencies.
         self._temperature = 10000
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple, Tensor] = OrderedDict()
 
     def forward(self, x: Tensor) -> Tensor:
         """
@@ -802,7 +1540,49 @@ class ACTSinusoidalPositionEmbedding2d(nn.Module):
         Returns:
             A (1, C, H, W) batch of corresponding sinusoidal positional embeddings.
         """
-        not_mask = torch.ones_like(x[0, :1])  # (1, H, W)
+        height, width = x.shape[-2:]
+        return self._get_or_build(
+            ("map", height, width, x.device, x.dtype),
+            lambda: self._build(height, width, x.device).to(dtype=x.dtype),
+        )
+
+    def tokens(self, x: Tensor, n_cameras: int = 1) -> Tensor:
+        """
+        Args:
+            x: A (B, C, H, n_cameras * W) batch of feature maps for `n_cameras` cameras concatenated along the
+                width dimension.
+            n_cameras: The number of cameras concatenated in `x`.
+        Returns:
+            A (H * n_cameras * W, 1, C) tensor of positional embeddings, flattened in the same order as
+            `einops.rearrange(x, "b c h w -> (h w) b c")`.
+        """
+        height, width = x.shape[-2], x.shape[-1] // n_cameras
+
+        def build():
+            pos_embed = self._build(height, width, x.device).to(dtype=x.dtype)
+            # All the cameras share the same feature map shape, hence the same positional embedding.
+            pos_embed = einops.repeat(pos_embed, "1 c h w -> 1 c h (n w)", n=n_cameras)
+            return einops.rearrange(pos_embed, "b c h w -> (h w) b c").contiguous()
+
+        return self._get_or_build(("tokens", n_cameras, height, width, x.device, x.dtype), build)
+
+    def _get_or_build(self, key: tuple, build: Callable[[], Tensor]) -> Tensor:
+        pos_embed = self._cache.get(key)
+        if pos_embed is not None:
+            self._cache.move_to_end(key)
+            return pos_embed
+        # The embeddings are constants: make sure that they are regular tensors outside of any autograd graph,
+        # even when first built under `torch.inference_mode` (they are reused for training afterwards).
+        with torch.inference_mode(False), torch.no_grad():
+            pos_embed = build()
+        self._cache[key] = pos_embed
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return pos_embed
+
+    def _build(self, height: int, width: int, device: torch.device) -> Tensor:
+        """Build the (1, C, H, W) embedding table (in float32)."""
+        not_mask = torch.ones((1, height, width), device=device)  # (1, H, W)
         # Note: These are like range(1, H+1) and range(1, W+1) respectively, but in most implementations
         # they would be range(0, H) and range(0, W). Keeping it at as is to match the original code.
         y_range = not_mask.cumsum(1, dtype=torch.float32)
@@ -815,7 +1595,7 @@ class ACTSinusoidalPositionEmbedding2d(nn.Module):
         x_range = x_range / (x_range[:, :, -1:] + self._eps) * self._two_pi
 
         inverse_frequency = self._temperature ** (
-            2 * (torch.arange(self.dimension, dtype=torch.float32, device=x.device) // 2) / self.dimension
+            2 * (torch.arange(self.dimension, dtype=torch.float32, device=device) // 2) / self.dimension
         )
 
         x_range = x_range.unsqueeze(-1) / inverse_frequency  # (1, H, W, 1)
@@ -830,6 +1610,63 @@ class ACTSinusoidalPositionEmbedding2d(nn.Module):
         return pos_embed
 
 
+class ACTImageTokenReducer(nn.Module):
+    """Reduces the number of camera feature tokens fed to the transformer encoder, see
+    `ACTConfig.image_token_reduction`.
+
+    "pool" average pools each camera's feature map (the last rows and columns get smaller windows when the
+    stride doesn't divide the map), and the tokens get the 2D sinusoidal positional embeddings of the pooled
+    grid. "topk" scores each token with a linear layer and keeps the `image_token_topk` highest scoring tokens
+    of each camera, in raster order, with the positional embeddings of their cells.
+    """
+
+    def __init__(self, config: ACTConfig):
+        super().__init__()
+        self.mode = config.image_token_reduction
+        self.pool_stride = config.image_token_pool_stride
+        self.topk = config.image_token_topk
+        if self.mode == "topk":
+            self.scorer = nn.Linear(config.dim_model, 1)
+
+    def forward(
+        self, cam_features: Tensor, n_cameras: int, pos_embed_2d: ACTSinusoidalPositionEmbedding2d
+    ) -> tuple[Tensor, Tensor]:
+        """
+        Args:
+            cam_features: A (B, C, H, n_cameras * W) batch of feature maps for `n_cameras` cameras
+                concatenated along the width dimension.
+            n_cameras: The number of cameras concatenated in `cam_features`.
+            pos_embed_2d: The positional embedding module for the camera feature maps.
+        Returns:
+            A (S, B, C) tensor of camera tokens and their (S, 1, C) or, for "topk", (S, B, C) positional
+            embeddings.
+        """
+        if self.mode == "pool":
+            cam_features = einops.rearrange(cam_features, "b c h (n w) -> (b n) c h w", n=n_cameras)
+            cam_features = F.avg_pool2d(cam_features, self.pool_stride, ceil_mode=True)
+            cam_features = einops.rearrange(cam_features, "(b n) c h w -> b c h (n w)", n=n_cameras)
+            return (
+                einops.rearrange(cam_features, "b c h w -> (h w) b c"),
+                pos_embed_2d.tokens(cam_features, n_cameras),
+            )
+
+        # Top-k token selection.
+        tokens = einops.rearrange(cam_features, "b c h (n w) -> b n (h w) c", n=n_cameras)
+        # The cameras share the same feature map shape, hence the same (H * W, C) positional embedding.
+        pos_embed = pos_embed_2d(cam_features[..., : cam_features.shape[-1] // n_cameras])
+        pos_embed = einops.rearrange(pos_embed, "1 c h w -> (h w) c")
+        scores = self.scorer(tokens).squeeze(-1)  # (B, N, H * W)
+        k = min(self.topk, scores.shape[-1])
+        indices = scores.topk(k, dim=-1).indices.sort(dim=-1).values  # (B, N, k)
+        tokens = tokens.gather(2, indices.unsqueeze(-1).expand(-1, -1, -1, tokens.shape[-1]))
+        # Scale the kept tokens by their score, so that the scorer gets gradients.
+        tokens = tokens * scores.gather(2, indices).sigmoid().unsqueeze(-1)
+        return (
+            einops.rearrange(tokens, "b n k c -> (n k) b c"),
+            einops.rearrange(pos_embed[indices], "b n k c -> (n k) b c"),
+        )
+
+
 def get_activation_fn(activation: str) -> Callable:
     """Return an activation function given a string."""
     if activation == "relu":
@@ -840,6 +1677,14 @@ def get_activation_fn(activation: str) -> Callable:
         return F.glu
     raise RuntimeError(f"activation should be relu/gelu/glu, not {activation}.")
 
+
+def _copy_to_host(actions: Tensor) -> Tensor:
+    """Copy `actions` to host memory in a single transfer (into pinned memory for CUDA tensors)."""
+    if actions.device.type == "cpu":
+        return actions
+    host_actions = torch.empty(actions.shape, dtype=actions.dtype, pin_memory=actions.device.type == "cuda")
+    return host_actions.copy_(actions)
+
 #dharun
 import matplotlib.pyplot as plt
 import numpy as np
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ONNX export of the ACT inference graph, and an ONNX Runtime inference backend for `ACTPolicy`.
+
+The exported graph covers `ACT.forward` at inference time (backbone, transformer encoder and decoder, and
+action head, without the VAE encoder). It takes normalized inputs and returns normalized actions, so the
+policy's own `normalize_inputs` and `unnormalize_outputs` still apply around it:
+```
+export_onnx(policy, "model.onnx", make_example_observation(policy.config))
+policy.set_inference_backend(ACTOnnxRuntimeBackend("model.onnx"))
+```
+
+Requires the `onnx` and `onnxruntime` packages.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import Tensor, nn
+
+from lerobot.common.policies.act.inference_act import ACT_INPUT_KEYS
+from lerobot.common.policies.act.modeling_act import ACT, ACTPolicy
+
+ONNX_OUTPUT_NAME = "action"
+
+
+class ACTInferenceGraph(nn.Module):
+    """Wraps `ACT` with positional tensor inputs and a single output, as needed for the ONNX export."""
+
+    def __init__(self, model: ACT, input_names: list[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs: Tensor) -> Tensor:
+        batch = dict(zip(self.input_names, inputs, strict=True))
+        return self.model(batch)[0]
+
+
+def export_onnx(
+    policy: ACTPolicy,
+    path: str | Path,
+    example_observation: dict[str, Tensor],
+    opset_version: int | None = None,
+) -> list[str]:
+    """Export the inference graph of `policy` to an ONNX file at `path`.
+
+    The graph is exported with the (static) shapes of `example_observation`, an observation as passed to
+    `ACTPolicy.select_action` (see `inference_act.make_example_observation`). `opset_version` defaults to the
+    exporter's default. Depending on the exporter, the weights may be written to a separate `<path>.data`
+    file, which must be kept next to the graph. Returns the names of the graph's inputs.
+    """
+    policy.eval()
+    with torch.no_grad():
+        inputs = policy._prepare_inputs(example_observation)
+        input_names = [name for name in ACT_INPUT_KEYS if name in inputs]
+        graph = ACTInferenceGraph(policy.model, input_names)
+        args = tuple(inputs[name] for name in input_names)
+        # Run the model once first so that the cached positional embeddings for these shapes are filled in
+        # before tracing, and are exported as constants.
+        graph(*args)
+        torch.onnx.export(
+            graph,
+            args,
+            str(path),
+            input_names=input_names,
+            output_names=[ONNX_OUTPUT_NAME],
+            opset_version=opset_version,
+        )
+    return input_names
+
+
+class ACTOnnxRuntimeBackend:
+    """Inference backend running an exported ACT graph (see `export_onnx`) with ONNX Runtime.
+
+    Use it with `ACTPolicy.set_inference_backend`. Inputs are moved to CPU and the actions are returned on the
+    inputs' device.
+    """
+
+    def __init__(self, path: str | Path, num_threads: int | None = None, providers: list[str] | None = None):
+        """
+        Args:
+            path: Path to the exported ONNX graph.
+            num_threads: Number of threads used by ONNX Runtime for intra-op parallelism. Defaults to ONNX
+                Runtime's default (the number of physical cores).
+            providers: ONNX Runtime execution providers. Defaults to the CPU execution provider.
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(path), sess_options=options, providers=providers or ["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, batch: dict[str, Tensor]) -> Tensor:
+        device = batch[self.input_names[0]].device
+        feeds = {
+            name: batch[name].detach().to("cpu", torch.float32).numpy(force=True) for name in self.input_names
+        }
+        actions = self.session.run([ONNX_OUTPUT_NAME], feeds)[0]
+        return torch.from_numpy(np.ascontiguousarray(actions)).to(device)
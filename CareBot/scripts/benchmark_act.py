@@ -0,0 +1,1327 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmarks for the hot paths of the ACT policy.
+
+All benchmarks run on randomly initialized weights and synthetic inputs shaped like the moss setup (see
+`configs/policy/act_moss_real.yaml`): 2 cameras at 480x640, a 6-dim state and a 6-dim action. No pretrained
+weights are downloaded, which does not change the timings.
+
+Usage examples:
+
+Compare one backbone call per camera against a single batched backbone call for 1, 2 and 4 cameras:
+```
+python lerobot/scripts/benchmark_act.py backbone --n-cameras 1 2 4
+```
+
+Time the 1D sinusoidal table construction, and the construction of `ACT`, for several chunk sizes:
+```
+python lerobot/scripts/benchmark_act.py sinusoidal --chunk-sizes 100 400 1000
+```
+
+Compare the size and load time of a full checkpoint against its inference-only export (without the VAE
+encoder):
+```
+python lerobot/scripts/benchmark_act.py inference-checkpoint
+```
+
+Measure the time and memory of a training step with and without input gradient capture (see
+`capture_input_gradients` in `ACTConfig`):
+```
+python lerobot/scripts/benchmark_act.py train-step --batch-size 8
+```
+
+Simulate a 30 fps control loop and compare the per-step latency of `select_action` with and without background
+prefetching of the next action chunk (see `prefetch_low_water_mark` in `ACTConfig`):
+```
+python lerobot/scripts/benchmark_act.py select-action --fps 30 --low-water-mark 30
+```
+
+Compare the ring buffer `ACTTemporalEnsembler` against the original implementation (which concatenates new
+tensors every step) for chunk sizes 100 and 400:
+```
+python lerobot/scripts/benchmark_act.py temporal-ensembler --chunk-sizes 100 400
+```
+
+Compare the `nn.MultiheadAttention` and `F.scaled_dot_product_attention` attention backends on the encoder and
+decoder layers, at the moss token count (2 cameras x 15x20 feature maps + 3 1D tokens):
+```
+python lerobot/scripts/benchmark_act.py attention --n-encoder-tokens 603
+```
+
+Compare the latency and size of the fp32 policy against its dynamic INT8 quantized variants (CPU only). See
+`lerobot/scripts/eval_act_offline.py quantize` for the action-space error on recorded episodes:
+```
+python lerobot/scripts/benchmark_act.py quantize
+```
+
+Compare the latency of the float32 policy against reduced precision variants (see
+`make_mixed_precision_policy` in `lerobot/common/policies/act/inference_act.py`):
+```
+python lerobot/scripts/benchmark_act.py precision --dtypes bfloat16
+```
+
+Measure the startup cost and steady-state latency of the `torch.compile`d static-shape inference engine
+against the eager model:
+```
+python lerobot/scripts/benchmark_act.py compile --attention-backend sdpa
+```
+
+Compare the latency of ONNX Runtime on the exported inference graph (see `export_act.py onnx`) against the
+eager model, with the same number of threads:
+```
+python lerobot/scripts/benchmark_act.py onnx --num-threads 4
+```
+
+Compare the per-key conversion of raw uint8 camera frames in `run.py` followed by the policy's normalization
+against the fused `ACTObservationPreprocessor`:
+```
+python lerobot/scripts/benchmark_act.py preprocess --device cuda
+```
+
+Compare the chunk prediction latency and the number of image tokens for full 480x640 frames against
+downscaled and cropped variants (see `image_crops` and `image_resize_shapes` in `ACTConfig`). See
+`lerobot/scripts/eval_act_offline.py checkpoint` for the accuracy of policies trained on each variant:
+```
+python lerobot/scripts/benchmark_act.py image-size --device cuda
+```
+
+Compare the chunk prediction latency with all the image tokens against pooled and top-k image tokens (see
+`image_token_reduction` in `ACTConfig`):
+```
+python lerobot/scripts/benchmark_act.py token-reduction --pool-strides 2 3 --topks 64 150
+```
+
+Break the latency of a policy query down by stage (see `ACTPolicy.enable_stage_timing`), and measure the
+overhead of the disabled instrumentation:
+```
+python lerobot/scripts/benchmark_act.py stages --device cuda
+```
+
+Compare the latency and parameter count of the vision backbones (see `vision_backbone` in `ACTConfig`), on
+their own and within a chunk prediction, at the moss resolution:
+```
+python lerobot/scripts/benchmark_act.py vision-backbone --backbones resnet18 mobilenet_v3_large regnet_y_400mf
+```
+
+Compare a training step from the camera images (with a trainable and with a frozen backbone) against a
+training step from cached float16 backbone feature maps (see
+`lerobot/common/policies/act/feature_cache_act.py`):
+```
+python lerobot/scripts/benchmark_act.py feature-cache --device cuda --batch-size 8
+```
+
+Compare the training step time, activation memory and maximum batch size without activation checkpointing,
+with checkpointing of the transformer layers, and with checkpointing of the backbone blocks as well (see
+`activation_checkpointing` in `ACTConfig`). On CUDA, the maximum batch size is searched for; on CPU, it's
+estimated from the activation memory per sample and `--memory-budget-gib`:
+```
+python lerobot/scripts/benchmark_act.py activation-checkpointing --device cuda --batch-size 8
+```
+
+Compare the backbone and chunk prediction latency of the eager policy against the policy with the backbone's
+frozen batch norms folded into its convolutions, in the default and channels last memory formats (see
+`make_fused_backbone_policy`), along with the max abs difference of their features and actions:
+```
+python lerobot/scripts/benchmark_act.py fuse-backbone --num-threads 4
+```
+
+Use `--device` to select the device and `--num-threads` to pin the number of CPU threads used by torch.
+"""
+
+import argparse
+import io
+import logging
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import Tensor
+from torchvision.ops.misc import FrozenBatchNorm2d
+
+from lerobot.common.policies.act import modeling_act
+from lerobot.common.policies.act.configuration_act import ACTConfig
+from lerobot.common.policies.act.inference_act import (
+    ACTCompiledEngine,
+    ACTObservationPreprocessor,
+    export_inference_checkpoint,
+    load_inference_policy,
+    make_example_observation,
+    make_fused_backbone_policy,
+    make_mixed_precision_policy,
+    quantize_dynamic_int8,
+)
+from lerobot.common.policies.act.modeling_act import (
+    ACT,
+    ACTDecoderLayer,
+    ACTEncoderLayer,
+    ACTPolicy,
+    ACTTemporalEnsembler,
+)
+from lerobot.common.policies.act.onnx_act import ACTOnnxRuntimeBackend, export_onnx
+from lerobot.common.utils.utils import init_logging
+
+
+def make_moss_config(n_cameras: int = 2, height: int = 480, width: int = 640, **overrides) -> ACTConfig:
+    """Make an `ACTConfig` matching `act_moss_real.yaml`, with `n_cameras` cameras of the given resolution.
+
+    Pretrained backbone weights are disabled by default so that nothing needs to be downloaded.
+    """
+    camera_keys = ["observation.images.laptop", "observation.images.phone"]
+    if n_cameras > len(camera_keys):
+        camera_keys += [f"observation.images.cam{i}" for i in range(len(camera_keys), n_cameras)]
+    camera_keys = camera_keys[:n_cameras]
+    kwargs = {
+        "chunk_size": 100,
+        "n_action_steps": 100,
+        "input_shapes": {
+            **{key: [3, height, width] for key in camera_keys},
+            "observation.state": [6],
+        },
+        "output_shapes": {"action": [6]},
+        "input_normalization_modes": {
+            **{key: "mean_std" for key in camera_keys},
+            "observation.state": "mean_std",
+        },
+        "output_normalization_modes": {"action": "mean_std"},
+        "pretrained_backbone_weights": None,
+        "n_decoder_layers": 1,
+    }
+    kwargs.update(overrides)
+    return ACTConfig(**kwargs)
+
+
+def make_dummy_batch(config: ACTConfig, batch_size: int = 1, device: str = "cpu") -> dict[str, Tensor]:
+    """Make a batch of random model inputs (already normalized, with the cameras stacked)."""
+    batch = {}
+    image_keys = [k for k in config.input_shapes if k.startswith("observation.image")]
+    if len(image_keys) > 0:
+        batch["observation.images"] = torch.rand(
+            batch_size, len(image_keys), *config.image_shape(image_keys[0]), device=device
+        )
+    for key in ["observation.state", "observation.environment_state"]:
+        if key in config.input_shapes:
+            batch[key] = torch.randn(batch_size, *config.input_shapes[key], device=device)
+    if config.time_embed:
+        batch["frame_index"] = torch.randint(0, config.max_ep_time, (batch_size, 1), device=device)
+    return batch
+
+
+def make_dummy_training_batch(
+    config: ACTConfig, batch_size: int = 1, device: str = "cpu"
+) -> dict[str, Tensor]:
+    """Make a batch of random (unnormalized) policy inputs and targets, as returned by the dataloader."""
+    batch = {}
+    for key, shape in config.input_shapes.items():
+        if key.startswith("observation.image"):
+            batch[key] = torch.rand(batch_size, *shape, device=device)
+        else:
+            batch[key] = torch.randn(batch_size, *shape, device=device)
+    batch["action"] = torch.randn(
+        batch_size, config.chunk_size, *config.output_shapes["action"], device=device
+    )
+    batch["action_is_pad"] = torch.zeros(batch_size, config.chunk_size, dtype=torch.bool, device=device)
+    if config.time_embed:
+        batch["frame_index"] = torch.randint(0, config.max_ep_time, (batch_size, 1), device=device)
+    return batch
+
+
+def make_dummy_dataset_stats(config: ACTConfig) -> dict[str, dict[str, Tensor]]:
+    """Make dataset statistics for all the normalized inputs and outputs (identity normalization)."""
+    stats = {}
+    modes = {**config.input_normalization_modes, **config.output_normalization_modes}
+    shapes = {**config.input_shapes, **config.output_shapes}
+    for key, mode in modes.items():
+        shape = (shapes[key][0], 1, 1) if key.startswith("observation.image") else tuple(shapes[key])
+        if mode == "mean_std":
+            stats[key] = {"mean": torch.zeros(shape), "std": torch.ones(shape)}
+        else:
+            stats[key] = {"min": -torch.ones(shape), "max": torch.ones(shape)}
+    return stats
+
+
+def synchronize(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def time_fn(fn, device: torch.device, n_warmup: int = 3, n_iters: int = 20) -> dict[str, float]:
+    """Time `fn()` and return summary statistics in milliseconds."""
+    for _ in range(n_warmup):
+        fn()
+    synchronize(device)
+    timings = []
+    for _ in range(n_iters):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+    }
+
+
+def print_table(rows: list[dict], title: str):
+    """Print a list of dictionaries (sharing the same keys) as a plain-text table."""
+    print(f"\n{title}")
+    columns = list(rows[0])
+    cells = [[f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths, strict=True)))
+    for r in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(r, widths, strict=True)))
+
+
+def benchmark_backbone(args):
+    """One backbone call per camera vs. a single backbone call with the cameras folded into the batch."""
+    device = torch.device(args.device)
+    rows = []
+    for n_cameras in args.n_cameras:
+        config = make_moss_config(n_cameras=n_cameras, height=args.height, width=args.width)
+        model = ACT(config).to(device).eval()
+        batch = make_dummy_batch(config, args.batch_size, args.device)
+
+        outputs = {}
+        timings = {}
+        for batch_cameras in [False, True]:
+            model.config.batch_cameras_in_backbone = batch_cameras
+            with torch.no_grad():
+                outputs[batch_cameras] = model(dict(batch))[0]
+                timings[batch_cameras] = time_fn(
+                    lambda model=model, batch=batch: model(dict(batch)),
+                    device,
+                    n_warmup=args.n_warmup,
+                    n_iters=args.n_iters,
+                )
+        rows.append(
+            {
+                "n_cameras": n_cameras,
+                "per_camera_ms": timings[False]["p50_ms"],
+                "batched_ms": timings[True]["p50_ms"],
+                "speedup": timings[False]["p50_ms"] / timings[True]["p50_ms"],
+                "max_abs_diff": (outputs[True] - outputs[False]).abs().max().item(),
+            }
+        )
+    print_table(rows, f"ACT.forward p50 latency on {args.device} (batch size {args.batch_size})")
+
+
+def _legacy_create_sinusoidal_pos_embedding(num_positions: int, dimension: int) -> Tensor:
+    """The original list comprehension implementation of `create_sinusoidal_pos_embedding`, for reference."""
+
+    def get_position_angle_vec(position):
+        return [position / np.power(10000, 2 * (hid_j // 2) / dimension) for hid_j in range(dimension)]
+
+    sinusoid_table = np.array([get_position_angle_vec(pos_i) for pos_i in range(num_positions)])
+    sinusoid_table[:, 0::2] = np.sin(sinusoid_table[:, 0::2])  # dim 2i
+    sinusoid_table[:, 1::2] = np.cos(sinusoid_table[:, 1::2])  # dim 2i+1
+    return torch.from_numpy(sinusoid_table).float()
+
+
+def benchmark_sinusoidal(args):
+    """Construction time of the 1D sinusoidal table (legacy, vectorized, cached) and of `ACT`."""
+    device = torch.device("cpu")
+    rows = []
+    for chunk_size in args.chunk_sizes:
+        config = make_moss_config(chunk_size=chunk_size, n_action_steps=chunk_size)
+        # This is the size of the VAE encoder's positional embedding: [cls, robot_state, *action_sequence].
+        num_positions = chunk_size + 2
+
+        def build_uncached(num_positions=num_positions, config=config):
+            modeling_act._create_sinusoidal_pos_embedding.cache_clear()
+            modeling_act.create_sinusoidal_pos_embedding(num_positions, config.dim_model)
+
+        def build_act_uncached(config=config):
+            modeling_act._create_sinusoidal_pos_embedding.cache_clear()
+            ACT(config)
+
+        legacy_table = _legacy_create_sinusoidal_pos_embedding(num_positions, config.dim_model)
+        table = modeling_act.create_sinusoidal_pos_embedding(num_positions, config.dim_model)
+        kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+        rows.append(
+            {
+                "chunk_size": chunk_size,
+                "legacy_ms": time_fn(
+                    partial(_legacy_create_sinusoidal_pos_embedding, num_positions, config.dim_model),
+                    device,
+                    **kwargs,
+                )["p50_ms"],
+                "vectorized_ms": time_fn(build_uncached, device, **kwargs)["p50_ms"],
+                "cached_ms": time_fn(
+                    partial(modeling_act.create_sinusoidal_pos_embedding, num_positions, config.dim_model),
+                    device,
+                    **kwargs,
+                )["p50_ms"],
+                "act_init_uncached_ms": time_fn(build_act_uncached, device, n_warmup=1, n_iters=3)["p50_ms"],
+                "act_init_cached_ms": time_fn(partial(ACT, config), device, n_warmup=1, n_iters=3)["p50_ms"],
+                "max_abs_diff": (table - legacy_table).abs().max().item(),
+            }
+        )
+    print_table(rows, f"Sinusoidal table and ACT construction time (dim_model={config.dim_model})")
+
+
+def benchmark_inference_checkpoint(args):
+    """Size and load time of a full checkpoint vs. its inference-only export."""
+    config = make_moss_config()
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        full_dir = Path(tmp_dir) / "full"
+        inference_dir = Path(tmp_dir) / "inference"
+        policy.save_pretrained(full_dir)
+        export_inference_checkpoint(policy, inference_dir)
+
+        rows = []
+        for name, directory, load_fn in [
+            ("full", full_dir, ACTPolicy.from_pretrained),
+            ("inference_only", inference_dir, load_inference_policy),
+        ]:
+            loaded = load_fn(directory)
+            load_ms = time_fn(
+                lambda load_fn=load_fn, directory=directory: load_fn(directory),
+                torch.device("cpu"),
+                n_warmup=1,
+                n_iters=args.n_iters,
+            )
+            rows.append(
+                {
+                    "checkpoint": name,
+                    "n_params_M": sum(p.numel() for p in loaded.parameters()) / 1e6,
+                    "file_MiB": (directory / "model.safetensors").stat().st_size / 2**20,
+                    "load_p50_ms": load_ms["p50_ms"],
+                }
+            )
+    print_table(rows, "Full vs. inference-only checkpoint (moss config)")
+
+
+def benchmark_train_step(args):
+    """Training step (forward + backward) with and without input gradient capture."""
+    device = torch.device(args.device)
+    rows = []
+    for capture in [False, True]:
+        config = make_moss_config(height=args.height, width=args.width, capture_input_gradients=capture)
+        torch.manual_seed(0)
+        policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).train()
+        batch = make_dummy_training_batch(config, args.batch_size, args.device)
+
+        def train_step(policy=policy, batch=batch):
+            policy.zero_grad(set_to_none=True)
+            policy.forward(batch)["loss"].backward()
+
+        # Count the bytes of the tensors saved for the backward pass (the activations), once per storage.
+        saved = {}
+
+        def pack_hook(tensor, saved=saved):
+            storage = tensor.untyped_storage()
+            saved[storage.data_ptr()] = storage.nbytes()
+            return tensor
+
+        with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+            loss = policy.forward(batch)["loss"]
+        loss.backward()
+        input_grad_bytes = sum(
+            t.grad.numel() * t.grad.element_size()
+            for t in policy.diagnostics.values()
+            if t.is_leaf and t.grad is not None
+        )
+        policy.diagnostics = {}
+
+        if device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(device)
+        timing = time_fn(train_step, device, n_warmup=args.n_warmup, n_iters=args.n_iters)
+        row = {
+            "capture_input_gradients": capture,
+            "p50_ms": timing["p50_ms"],
+            "saved_activations_MiB": sum(saved.values()) / 2**20,
+            "input_grads_MiB": input_grad_bytes / 2**20,
+        }
+        if device.type == "cuda":
+            row["peak_allocated_MiB"] = torch.cuda.max_memory_allocated(device) / 2**20
+        rows.append(row)
+    print_table(
+        rows,
+        f"ACTPolicy training step on {args.device} "
+        f"(batch size {args.batch_size}, {args.height}x{args.width})",
+    )
+
+
+def benchmark_select_action(args):
+    """Per-step `select_action` latency in a simulated control loop, with and without prefetching."""
+    device = torch.device(args.device)
+    rows = []
+    for low_water_mark in [None, args.low_water_mark]:
+        config = make_moss_config(
+            height=args.height,
+            width=args.width,
+            n_action_steps=args.n_action_steps,
+            prefetch_low_water_mark=low_water_mark,
+        )
+        policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+        batch = make_dummy_training_batch(config, 1, args.device)
+        del batch["action"], batch["action_is_pad"]
+
+        for _ in range(args.n_warmup):
+            policy.select_action(batch)
+        policy.reset()
+        policy.select_action_latency.reset()
+        for _ in range(args.n_steps):
+            start = time.perf_counter()
+            policy.select_action(batch)
+            synchronize(device)
+            # Sleep for the rest of the control period, like the robot's control loop does.
+            time.sleep(max(0.0, 1 / args.fps - (time.perf_counter() - start)))
+        policy.reset()
+
+        summary = policy.select_action_latency.summary()
+        rows.append(
+            {
+                "prefetch_low_water_mark": low_water_mark,
+                **{k: summary[k] for k in ["p50_ms", "p95_ms", "p99_ms", "max_ms"]},
+                "over_budget_steps": int(
+                    sum(latency_s > 1 / args.fps for latency_s in policy.select_action_latency._latencies_s)
+                ),
+                "stalls": policy.n_prefetch_stalls,
+            }
+        )
+    print_table(
+        rows,
+        f"select_action latency on {args.device} over {args.n_steps} steps at {args.fps} fps "
+        f"(n_action_steps={args.n_action_steps}, {args.height}x{args.width})",
+    )
+
+
+class _LegacyACTTemporalEnsembler:
+    """The original `ACTTemporalEnsembler`, which allocates new tensors every step, for reference."""
+
+    def __init__(self, temporal_ensemble_coeff: float, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self.ensemble_weights = torch.exp(-temporal_ensemble_coeff * torch.arange(chunk_size))
+        self.ensemble_weights_cumsum = torch.cumsum(self.ensemble_weights, dim=0)
+        self.reset()
+
+    def reset(self):
+        self.ensembled_actions = None
+        self.ensembled_actions_count = None
+
+    def update(self, actions: Tensor) -> Tensor:
+        self.ensemble_weights = self.ensemble_weights.to(device=actions.device)
+        self.ensemble_weights_cumsum = self.ensemble_weights_cumsum.to(device=actions.device)
+        if self.ensembled_actions is None:
+            self.ensembled_actions = actions.clone()
+            self.ensembled_actions_count = torch.ones(
+                (self.chunk_size, 1), dtype=torch.long, device=self.ensembled_actions.device
+            )
+        else:
+            self.ensembled_actions *= self.ensemble_weights_cumsum[self.ensembled_actions_count - 1]
+            self.ensembled_actions += actions[:, :-1] * self.ensemble_weights[self.ensembled_actions_count]
+            self.ensembled_actions /= self.ensemble_weights_cumsum[self.ensembled_actions_count]
+            self.ensembled_actions_count = torch.clamp(self.ensembled_actions_count + 1, max=self.chunk_size)
+            self.ensembled_actions = torch.cat([self.ensembled_actions, actions[:, -1:]], dim=1)
+            self.ensembled_actions_count = torch.cat(
+                [self.ensembled_actions_count, torch.ones_like(self.ensembled_actions_count[-1:])]
+            )
+        action, self.ensembled_actions, self.ensembled_actions_count = (
+            self.ensembled_actions[:, 0],
+            self.ensembled_actions[:, 1:],
+            self.ensembled_actions_count[1:],
+        )
+        return action
+
+
+def benchmark_temporal_ensembler(args):
+    """Per-step update time of the ring buffer temporal ensembler vs. the original implementation."""
+    device = torch.device(args.device)
+    rows = []
+    for chunk_size in args.chunk_sizes:
+        # Pre-generate the action chunks of an episode so that only the ensembler updates are timed.
+        n_steps = args.n_steps
+        chunks = torch.randn(n_steps, args.batch_size, chunk_size, args.action_dim, device=device)
+        ensemblers = {
+            "legacy": _LegacyACTTemporalEnsembler(args.temporal_ensemble_coeff, chunk_size),
+            "ring_buffer": ACTTemporalEnsembler(args.temporal_ensemble_coeff, chunk_size),
+        }
+
+        def run_episode(ensembler, chunks=chunks):
+            ensembler.reset()
+            return [ensembler.update(chunk) for chunk in chunks]
+
+        outputs = {name: torch.stack(run_episode(e)) for name, e in ensemblers.items()}
+        timings = {
+            name: time_fn(lambda e=e: run_episode(e), device, n_warmup=args.n_warmup, n_iters=args.n_iters)
+            for name, e in ensemblers.items()
+        }
+        rows.append(
+            {
+                "chunk_size": chunk_size,
+                "legacy_us_per_step": timings["legacy"]["p50_ms"] * 1000 / n_steps,
+                "ring_buffer_us_per_step": timings["ring_buffer"]["p50_ms"] * 1000 / n_steps,
+                "speedup": timings["legacy"]["p50_ms"] / timings["ring_buffer"]["p50_ms"],
+                "max_abs_diff": (outputs["legacy"] - outputs["ring_buffer"]).abs().max().item(),
+            }
+        )
+    print_table(
+        rows,
+        f"Temporal ensembler update on {args.device} "
+        f"(batch size {args.batch_size}, {n_steps} steps per episode)",
+    )
+
+
+def benchmark_attention(args):
+    """Encoder and decoder layer latency with the "mha" and "sdpa" attention backends."""
+    device = torch.device(args.device)
+    config = make_moss_config()
+    encoder_in = torch.randn(args.n_encoder_tokens, args.batch_size, config.dim_model, device=device)
+    encoder_pos_embed = torch.randn(args.n_encoder_tokens, 1, config.dim_model, device=device)
+    decoder_in = torch.zeros(config.chunk_size, args.batch_size, config.dim_model, device=device)
+    decoder_pos_embed = torch.randn(config.chunk_size, 1, config.dim_model, device=device)
+
+    layers = {
+        "encoder": lambda cfg: ACTEncoderLayer(cfg),
+        "decoder": lambda cfg: ACTDecoderLayer(cfg),
+    }
+    calls = {
+        "encoder": lambda layer: layer(encoder_in, pos_embed=encoder_pos_embed),
+        "decoder": lambda layer: layer(
+            decoder_in, encoder_in, decoder_pos_embed=decoder_pos_embed, encoder_pos_embed=encoder_pos_embed
+        ),
+    }
+    rows = []
+    for name, make_layer in layers.items():
+        mha_layer = make_layer(make_moss_config(attention_backend="mha")).to(device).eval()
+        sdpa_layer = make_layer(make_moss_config(attention_backend="sdpa")).to(device).eval()
+        # The backends have the same parameters, so the weights can be loaded as is.
+        sdpa_layer.load_state_dict(mha_layer.state_dict())
+
+        outputs = {}
+        timings = {}
+        for backend, layer in [("mha", mha_layer), ("sdpa", sdpa_layer)]:
+            with torch.no_grad():
+                outputs[backend] = calls[name](layer)
+                timings[backend] = time_fn(
+                    lambda layer=layer, call=calls[name]: call(layer),
+                    device,
+                    n_warmup=args.n_warmup,
+                    n_iters=args.n_iters,
+                )
+        rows.append(
+            {
+                "layer": name,
+                "mha_ms": timings["mha"]["p50_ms"],
+                "sdpa_ms": timings["sdpa"]["p50_ms"],
+                "speedup": timings["mha"]["p50_ms"] / timings["sdpa"]["p50_ms"],
+                "max_abs_diff": (outputs["mha"] - outputs["sdpa"]).abs().max().item(),
+            }
+        )
+    print_table(
+        rows,
+        f"Transformer layer p50 latency on {args.device} ({args.n_encoder_tokens} encoder tokens, "
+        f"{config.chunk_size} decoder tokens, batch size {args.batch_size})",
+    )
+
+
+def benchmark_quantize(args):
+    """Chunk prediction latency and model size of the fp32 policy vs. its dynamic INT8 variants, on CPU."""
+    device = torch.device("cpu")
+    config = make_moss_config(attention_backend=args.attention_backend)
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).eval()
+    batch = make_dummy_training_batch(config, 1)
+    variants = {
+        "fp32": policy,
+        "int8_transformer": quantize_dynamic_int8(policy),
+        "int8_transformer_backbone": quantize_dynamic_int8(policy, quantize_backbone=True),
+    }
+    reference = policy.predict_action_chunk(batch)
+    rows = []
+    for name, variant in variants.items():
+        buffer = io.BytesIO()
+        torch.save(variant.state_dict(), buffer)
+        rows.append(
+            {
+                "variant": name,
+                "p50_ms": time_fn(
+                    lambda v=variant: v.predict_action_chunk(batch),
+                    device,
+                    n_warmup=args.n_warmup,
+                    n_iters=args.n_iters,
+                )["p50_ms"],
+                "size_MiB": buffer.getbuffer().nbytes / 2**20,
+                "max_abs_diff": (variant.predict_action_chunk(batch) - reference).abs().max().item(),
+            }
+        )
+    print_table(
+        rows,
+        f"Action chunk prediction on cpu with random weights ({args.attention_backend} attention). Errors on "
+        "random weights are not representative, use eval_act_offline.py on a trained policy.",
+    )
+
+
+def benchmark_precision(args):
+    """Chunk prediction latency of the float32 policy vs. reduced precision variants."""
+    device = torch.device(args.device)
+    config = make_moss_config(attention_backend=args.attention_backend)
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+    batch = make_dummy_training_batch(config, 1, args.device)
+    variants = {"float32": policy}
+    for dtype in args.dtypes:
+        variants[f"{dtype} (backbone only)"] = make_mixed_precision_policy(policy, {"backbone": dtype})
+        variants[f"{dtype} (encoder+decoder)"] = make_mixed_precision_policy(
+            policy, {"encoder": dtype, "decoder": dtype}
+        )
+        variants[dtype] = make_mixed_precision_policy(policy, dtype)
+    reference = policy.predict_action_chunk(batch)
+    rows = []
+    for name, variant in variants.items():
+        timing = time_fn(
+            lambda v=variant: v.predict_action_chunk(batch),
+            device,
+            n_warmup=args.n_warmup,
+            n_iters=args.n_iters,
+        )
+        rows.append(
+            {
+                "variant": name,
+                "p50_ms": timing["p50_ms"],
+                "speedup": None,
+                "max_abs_diff": (variant.predict_action_chunk(batch) - reference).abs().max().item(),
+            }
+        )
+    for row in rows:
+        row["speedup"] = rows[0]["p50_ms"] / row["p50_ms"]
+    print_table(
+        rows,
+        f"Action chunk prediction on {args.device} with random weights ({args.attention_backend} attention). "
+        "Errors on random weights are not representative, use eval_act_offline.py on a trained policy.",
+    )
+
+
+def benchmark_compile(args):
+    """Compile time and steady-state chunk prediction latency of `ACTCompiledEngine` vs. the eager model."""
+    device = torch.device(args.device)
+    config = make_moss_config(attention_backend=args.attention_backend)
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+    observation = make_example_observation(config, device=device)
+    kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+
+    eager = time_fn(lambda: policy.predict_action_chunk(observation), device, **kwargs)
+    reference = policy.predict_action_chunk(observation)
+
+    engine = ACTCompiledEngine(policy, observation, mode=args.mode)
+    policy.set_inference_backend(engine)
+    compiled = time_fn(lambda: policy.predict_action_chunk(observation), device, **kwargs)
+    max_abs_diff = (policy.predict_action_chunk(observation) - reference).abs().max().item()
+    # A different batch size doesn't match the compiled signature, and runs the eager model.
+    fallback_observation = make_example_observation(config, batch_size=2, device=device)
+    fallback = time_fn(lambda: policy.predict_action_chunk(fallback_observation), device, **kwargs)
+
+    rows = [
+        {"path": "eager", "startup_s": 0.0, "p50_ms": eager["p50_ms"], "p95_ms": eager["p95_ms"]},
+        {
+            "path": "compiled",
+            "startup_s": engine.compile_s + engine.warmup_s,
+            "p50_ms": compiled["p50_ms"],
+            "p95_ms": compiled["p95_ms"],
+        },
+        {
+            "path": "fallback (batch size 2)",
+            "startup_s": 0.0,
+            "p50_ms": fallback["p50_ms"],
+            "p95_ms": fallback["p95_ms"],
+        },
+    ]
+    print_table(
+        rows,
+        f"Action chunk prediction on {args.device} ({args.attention_backend} attention, compile mode "
+        f"{args.mode}). Compiled vs. eager max abs diff: {max_abs_diff:.2e}",
+    )
+
+
+def benchmark_onnx(args):
+    """Chunk prediction latency of ONNX Runtime on the exported inference graph vs. the eager model (CPU)."""
+    device = torch.device("cpu")
+    config = make_moss_config(attention_backend=args.attention_backend)
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).eval()
+    observation = make_example_observation(config)
+    for key in observation:
+        observation[key] = torch.rand_like(observation[key])
+    kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+
+    eager = time_fn(lambda: policy.predict_action_chunk(observation), device, **kwargs)
+    reference = policy.predict_action_chunk(observation)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_path = Path(tmp_dir) / "model.onnx"
+        start = time.perf_counter()
+        export_onnx(policy, onnx_path, observation)
+        export_s = time.perf_counter() - start
+        start = time.perf_counter()
+        policy.set_inference_backend(ACTOnnxRuntimeBackend(onnx_path, num_threads=torch.get_num_threads()))
+        load_s = time.perf_counter() - start
+    onnx = time_fn(lambda: policy.predict_action_chunk(observation), device, **kwargs)
+    max_abs_diff = (policy.predict_action_chunk(observation) - reference).abs().max().item()
+
+    rows = [
+        {"path": "eager", "startup_s": 0.0, "p50_ms": eager["p50_ms"], "p95_ms": eager["p95_ms"]},
+        {
+            "path": "onnxruntime",
+            "startup_s": export_s + load_s,
+            "p50_ms": onnx["p50_ms"],
+            "p95_ms": onnx["p95_ms"],
+        },
+    ]
+    print_table(
+        rows,
+        f"Action chunk prediction on cpu ({args.attention_backend} attention, {torch.get_num_threads()} "
+        f"threads). ONNX Runtime vs. eager max abs diff: {max_abs_diff:.2e}",
+    )
+
+
+def benchmark_preprocess(args):
+    """Per-key conversion of raw robot observations + `_prepare_inputs` vs. `ACTObservationPreprocessor`."""
+    device = torch.device(args.device)
+    config = make_moss_config(n_cameras=args.n_cameras)
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+    # A raw observation, as returned by `ManipulatorRobot.capture_observation`.
+    observation = {"observation.state": torch.randn(6)}
+    for key in policy.expected_image_keys:
+        observation[key] = torch.randint(0, 256, (480, 640, 3), dtype=torch.uint8)
+
+    def per_key():
+        # The conversion in `run.py`, followed by the normalization and stacking in `select_action`.
+        batch = {}
+        for name, value in observation.items():
+            if "image" in name:
+                value = value.type(torch.float32) / 255
+                value = value.permute(2, 0, 1).contiguous()
+            batch[name] = value.unsqueeze(0).to(device)
+        return policy._prepare_inputs(batch)
+
+    preprocess = ACTObservationPreprocessor(policy)
+    kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+    rows = [
+        {"path": "per-key", **time_fn(per_key, device, **kwargs)},
+        {"path": "fused", **time_fn(lambda: preprocess(observation), device, **kwargs)},
+    ]
+    reference = per_key()
+    inputs = preprocess(observation)
+    max_abs_diff = max((inputs[k] - reference[k]).abs().max().item() for k in inputs)
+    print_table(
+        rows,
+        f"Observation preprocessing on {args.device} ({args.n_cameras} cameras at 480x640). Fused vs. per-key"
+        f" max abs diff: {max_abs_diff:.2e}",
+    )
+
+
+def benchmark_image_size(args):
+    """Chunk prediction latency for full resolution frames vs. downscaled and cropped ones."""
+    device = torch.device(args.device)
+    camera_keys = ["observation.images.laptop", "observation.images.phone"]
+    # Center 360x480 region of interest.
+    crop = [60, 80, 360, 480]
+    variants = {
+        "480x640": {},
+        "240x320": {"image_resize_shapes": {k: [240, 320] for k in camera_keys}},
+        "crop 360x480": {"image_crops": {k: crop for k in camera_keys}},
+        "crop 360x480 -> 180x240": {
+            "image_crops": {k: crop for k in camera_keys},
+            "image_resize_shapes": {k: [180, 240] for k in camera_keys},
+        },
+    }
+    rows = []
+    for name, overrides in variants.items():
+        config = make_moss_config(attention_backend=args.attention_backend, **overrides)
+        policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+        observation = make_example_observation(config, device=device)
+        for key in observation:
+            observation[key] = torch.rand_like(observation[key])
+        inputs = policy._prepare_inputs(observation)
+        with torch.no_grad():
+            n_tokens = policy.model.backbone(inputs["observation.images"][:, 0])["feature_map"][0, 0].numel()
+        timing = time_fn(
+            lambda p=policy, o=observation: p.predict_action_chunk(o),
+            device,
+            n_warmup=args.n_warmup,
+            n_iters=args.n_iters,
+        )
+        rows.append(
+            {
+                "variant": name,
+                "backbone_input": "x".join(map(str, config.image_shape(camera_keys[0])[1:])),
+                "tokens_per_camera": n_tokens,
+                "p50_ms": timing["p50_ms"],
+                "p95_ms": timing["p95_ms"],
+            }
+        )
+    print_table(
+        rows,
+        f"Action chunk prediction on {args.device} from 2 cameras at 480x640 ({args.attention_backend} "
+        "attention).",
+    )
+
+
+def benchmark_token_reduction(args):
+    """Chunk prediction latency with all the image tokens vs. pooled and top-k image tokens."""
+    device = torch.device(args.device)
+    variants = {"all tokens": {}}
+    for stride in args.pool_strides:
+        variants[f"pool {stride}"] = {"image_token_reduction": "pool", "image_token_pool_stride": stride}
+    for k in args.topks:
+        variants[f"top-{k}"] = {"image_token_reduction": "topk", "image_token_topk": k}
+    rows = []
+    for name, overrides in variants.items():
+        config = make_moss_config(attention_backend=args.attention_backend, **overrides)
+        policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+        batch = make_dummy_batch(config, 1, args.device)
+        # Count the encoder tokens with a hook on the encoder's input.
+        n_tokens = []
+        handle = policy.model.encoder.register_forward_pre_hook(
+            lambda _, args, n_tokens=n_tokens: n_tokens.append(len(args[0]))
+        )
+        with torch.no_grad():
+            policy.model(batch)
+        handle.remove()
+        timing = time_fn(
+            lambda p=policy, b=batch: p.model(b), device, n_warmup=args.n_warmup, n_iters=args.n_iters
+        )
+        rows.append(
+            {
+                "variant": name,
+                "encoder_tokens": n_tokens[0],
+                "p50_ms": timing["p50_ms"],
+                "p95_ms": timing["p95_ms"],
+                "speedup": None,
+            }
+        )
+    for row in rows:
+        row["speedup"] = rows[0]["p50_ms"] / row["p50_ms"]
+    print_table(
+        rows,
+        f"ACT forward pass on {args.device} (2 cameras at 480x640, {args.attention_backend} attention).",
+    )
+
+
+def benchmark_stages(args):
+    """Per-stage latency of a policy query, and overhead of the stage timer when disabled."""
+    device = torch.device(args.device)
+    config = make_moss_config(
+        n_action_steps=1,
+        attention_backend=args.attention_backend,
+        batch_cameras_in_backbone=not args.per_camera,
+    )
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).eval()
+    observation = make_example_observation(config, device=device)
+    kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+
+    disabled = time_fn(lambda: policy.select_action(observation), device, **kwargs)
+    policy.enable_stage_timing()
+    enabled = time_fn(lambda: policy.select_action(observation), device, **kwargs)
+    rows = [
+        {"stage": name, **{k: v for k, v in summary.items() if k in ["p50_ms", "p95_ms", "p99_ms", "max_ms"]}}
+        for name, summary in policy.stage_timer.summary().items()
+    ]
+    print_table(rows, f"Stages of `select_action` on {args.device} ({args.attention_backend} attention).")
+
+    policy.enable_stage_timing(False)
+    n_calls = 100_000
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        with policy.stage_timer.stage("noop"):
+            pass
+    overhead_us = (time.perf_counter() - start) / n_calls * 1e6
+    print(
+        f"\n`select_action` p50: {disabled['p50_ms']:.3f} ms with the stage timer disabled, "
+        f"{enabled['p50_ms']:.3f} ms enabled. Disabled timer overhead: {overhead_us:.2f} us per stage."
+    )
+
+
+def benchmark_vision_backbone(args):
+    """Backbone and chunk prediction latency, and backbone parameter count, of several vision backbones."""
+    device = torch.device(args.device)
+    kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+    rows = []
+    for backbone_name in args.backbones:
+        config = make_moss_config(vision_backbone=backbone_name, attention_backend=args.attention_backend)
+        model = ACT(config).to(device).eval()
+        batch = make_dummy_batch(config, 1, args.device)
+        images = batch["observation.images"].flatten(0, 1)
+        with torch.no_grad():
+            feature_map = model.backbone(images)["feature_map"]
+            backbone_timing = time_fn(
+                lambda model=model, images=images: model.backbone(images), device, **kwargs
+            )
+            forward_timing = time_fn(lambda model=model, batch=batch: model(dict(batch)), device, **kwargs)
+        rows.append(
+            {
+                "backbone": backbone_name,
+                "backbone_params_M": sum(p.numel() for p in model.backbone.parameters()) / 1e6,
+                "feature_map": "x".join(map(str, feature_map.shape[1:])),
+                "backbone_p50_ms": backbone_timing["p50_ms"],
+                "forward_p50_ms": forward_timing["p50_ms"],
+                "forward_p95_ms": forward_timing["p95_ms"],
+            }
+        )
+    print_table(
+        rows,
+        f"Vision backbones on {args.device}: {config.image_shape('observation.images.laptop')} images, "
+        f"2 cameras ({args.attention_backend} attention).",
+    )
+
+
+def benchmark_feature_cache(args):
+    """Training step (forward + backward) from the camera images vs. from cached backbone feature maps."""
+    device = torch.device(args.device)
+    rows = []
+    for inputs, freeze_backbone in [("images", False), ("images", True), ("cached features", True)]:
+        config = make_moss_config(freeze_backbone=freeze_backbone)
+        torch.manual_seed(0)
+        policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).train()
+        batch = make_dummy_training_batch(config, args.batch_size, args.device)
+        if inputs == "cached features":
+            # As served by `ACTImageFeatureDataset`.
+            with torch.no_grad():
+                images = policy._prepare_inputs(batch)["observation.images"]
+                batch["observation.image_features"] = torch.stack(
+                    [policy.model.backbone(images[:, i])["feature_map"] for i in range(images.shape[1])],
+                    dim=1,
+                ).half()
+            for key in policy.expected_image_keys:
+                del batch[key]
+
+        def train_step(policy=policy, batch=batch):
+            policy.zero_grad(set_to_none=True)
+            policy.forward(batch)["loss"].backward()
+
+        timing = time_fn(train_step, device, n_warmup=args.n_warmup, n_iters=args.n_iters)
+        rows.append(
+            {
+                "inputs": inputs,
+                "freeze_backbone": freeze_backbone,
+                "p50_ms": timing["p50_ms"],
+                "p95_ms": timing["p95_ms"],
+            }
+        )
+    print_table(rows, f"ACTPolicy training step on {args.device} (batch size {args.batch_size}, 2 cameras)")
+
+
+def benchmark_activation_checkpointing(args):
+    """Training step time, activation memory and maximum batch size with and without activation
+    checkpointing."""
+    device = torch.device(args.device)
+    variants = {
+        "none": [],
+        "transformer": ["vae_encoder", "encoder", "decoder"],
+        "transformer+backbone": ["backbone", "vae_encoder", "encoder", "decoder"],
+    }
+    rows = []
+    for name, modules in variants.items():
+        config = make_moss_config(n_vae_encoder_layers=4, activation_checkpointing=modules)
+        torch.manual_seed(0)
+        policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config)).to(device).train()
+        optimizer = torch.optim.AdamW(policy.parameters(), lr=1e-5)
+
+        def train_step(batch, policy=policy, optimizer=optimizer):
+            policy.forward(batch)["loss"].backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+        # Count the bytes of the tensors saved for the backward pass (the activations), once per storage.
+        saved = {}
+
+        def pack_hook(tensor, saved=saved):
+            storage = tensor.untyped_storage()
+            saved[storage.data_ptr()] = storage.nbytes()
+            return tensor
+
+        batch = make_dummy_training_batch(config, args.batch_size, args.device)
+        with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+            loss = policy.forward(batch)["loss"]
+        loss.backward()
+        optimizer.zero_grad(set_to_none=True)
+        timing = time_fn(
+            lambda batch=batch: train_step(batch), device, n_warmup=args.n_warmup, n_iters=args.n_iters
+        )
+        activations_per_sample = sum(saved.values()) / args.batch_size
+        row = {
+            "checkpointing": name,
+            "p50_ms": timing["p50_ms"],
+            "activations_MiB_per_sample": activations_per_sample / 2**20,
+        }
+
+        if device.type == "cuda":
+            # Double the batch size until it runs out of memory.
+            max_batch_size = None
+            batch_size = args.batch_size
+            while batch_size <= args.max_batch_size:
+                try:
+                    train_step(make_dummy_training_batch(config, batch_size, args.device))
+                except torch.cuda.OutOfMemoryError:
+                    break
+                finally:
+                    optimizer.zero_grad(set_to_none=True)
+                    torch.cuda.empty_cache()
+                max_batch_size = batch_size
+                batch_size *= 2
+            row["max_batch_size"] = max_batch_size
+        else:
+            # Weights, gradients and the two AdamW moments.
+            static_bytes = 4 * sum(p.numel() * p.element_size() for p in policy.parameters())
+            row["est_max_batch_size"] = int(
+                (args.memory_budget_gib * 2**30 - static_bytes) // activations_per_sample
+            )
+        rows.append(row)
+    print_table(
+        rows,
+        f"ACTPolicy training step on {args.device} (batch size {args.batch_size}, 2 cameras, 4 + 4 encoder "
+        "layers)",
+    )
+
+
+def benchmark_fuse_backbone(args):
+    """Backbone and chunk prediction latency of the eager policy vs. its fused backbone variants."""
+    device = torch.device(args.device)
+    kwargs = {"n_warmup": args.n_warmup, "n_iters": args.n_iters}
+    config = make_moss_config(vision_backbone=args.vision_backbone, attention_backend=args.attention_backend)
+    policy = ACTPolicy(config, dataset_stats=make_dummy_dataset_stats(config))
+    # Randomize the frozen batch norms, which are the identity when randomly initialized, so that the parity
+    # check is meaningful.
+    for module in policy.model.backbone.modules():
+        if isinstance(module, FrozenBatchNorm2d):
+            module.weight.uniform_(0.5, 1.5)
+            module.bias.normal_(0, 0.1)
+            module.running_mean.normal_(0, 0.1)
+            module.running_var.uniform_(0.5, 1.5)
+    policy.to(device).eval()
+    variants = {
+        "eager": policy,
+        "fused": make_fused_backbone_policy(policy, channels_last=False),
+        "fused+channels_last": make_fused_backbone_policy(policy, channels_last=True),
+    }
+    batch = make_dummy_training_batch(config, 1, args.device)
+    images = policy._prepare_inputs(dict(batch))["observation.images"].flatten(0, 1)
+    with torch.no_grad():
+        reference_features = policy.model.backbone(images)["feature_map"]
+    reference_actions = policy.predict_action_chunk(batch)
+    rows = []
+    for name, variant in variants.items():
+        with torch.no_grad():
+            backbone_timing = time_fn(lambda v=variant: v.model.backbone(images), device, **kwargs)
+            features = variant.model.backbone(images)["feature_map"]
+        chunk_timing = time_fn(lambda v=variant: v.predict_action_chunk(batch), device, **kwargs)
+        rows.append(
+            {
+                "variant": name,
+                "backbone_p50_ms": backbone_timing["p50_ms"],
+                "backbone_speedup": None,
+                "chunk_p50_ms": chunk_timing["p50_ms"],
+                "feature_max_abs_diff": (features - reference_features).abs().max().item(),
+                "action_max_abs_diff": (variant.predict_action_chunk(batch) - reference_actions)
+                .abs()
+                .max()
+                .item(),
+            }
+        )
+    for row in rows:
+        row["backbone_speedup"] = rows[0]["backbone_p50_ms"] / row["backbone_p50_ms"]
+    print_table(
+        rows,
+        f"{args.vision_backbone} backbone on {args.device}: 2 cameras at "
+        f"{config.image_shape('observation.images.laptop')} ({args.attention_backend} attention).",
+    )
+
+
+if __name__ == "__main__":
+    init_logging()
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    # Set common options for all the subparsers
+    base_parser = argparse.ArgumentParser(add_help=False)
+    base_parser.add_argument("--device", type=str, default="cpu", help="Device to run the benchmark on.")
+    base_parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=None,
+        help="Number of threads used by torch for intra-op parallelism on CPU. Defaults to torch's default.",
+    )
+    base_parser.add_argument("--n-warmup", type=int, default=3, help="Number of untimed warm-up iterations.")
+    base_parser.add_argument("--n-iters", type=int, default=20, help="Number of timed iterations.")
+
+    parser_backbone = subparsers.add_parser("backbone", parents=[base_parser])
+    parser_backbone.add_argument(
+        "--n-cameras", type=int, nargs="+", default=[1, 2, 4], help="Numbers of cameras to benchmark."
+    )
+    parser_backbone.add_argument("--batch-size", type=int, default=1)
+    parser_backbone.add_argument("--height", type=int, default=480)
+    parser_backbone.add_argument("--width", type=int, default=640)
+
+    parser_sinusoidal = subparsers.add_parser("sinusoidal", parents=[base_parser])
+    parser_sinusoidal.add_argument(
+        "--chunk-sizes", type=int, nargs="+", default=[100, 400, 1000], help="Chunk sizes to benchmark."
+    )
+
+    subparsers.add_parser("inference-checkpoint", parents=[base_parser])
+
+    parser_train_step = subparsers.add_parser("train-step", parents=[base_parser])
+    parser_train_step.add_argument("--batch-size", type=int, default=8)
+    parser_train_step.add_argument("--height", type=int, default=480)
+    parser_train_step.add_argument("--width", type=int, default=640)
+
+    parser_select_action = subparsers.add_parser("select-action", parents=[base_parser])
+    parser_select_action.add_argument("--fps", type=int, default=30, help="Frequency of the control loop.")
+    parser_select_action.add_argument("--n-steps", type=int, default=300, help="Number of control steps.")
+    parser_select_action.add_argument("--n-action-steps", type=int, default=100)
+    parser_select_action.add_argument("--low-water-mark", type=int, default=30)
+    parser_select_action.add_argument("--height", type=int, default=480)
+    parser_select_action.add_argument("--width", type=int, default=640)
+
+    parser_ensembler = subparsers.add_parser("temporal-ensembler", parents=[base_parser])
+    parser_ensembler.add_argument(
+        "--chunk-sizes", type=int, nargs="+", default=[100, 400], help="Chunk sizes to benchmark."
+    )
+    parser_ensembler.add_argument("--n-steps", type=int, default=900, help="Number of steps per episode.")
+    parser_ensembler.add_argument("--batch-size", type=int, default=1)
+    parser_ensembler.add_argument("--action-dim", type=int, default=6)
+    parser_ensembler.add_argument("--temporal-ensemble-coeff", type=float, default=0.01)
+
+    parser_attention = subparsers.add_parser("attention", parents=[base_parser])
+    parser_attention.add_argument(
+        "--n-encoder-tokens",
+        type=int,
+        default=603,
+        help="Number of encoder tokens. The default matches 2 cameras at 480x640 plus the 3 1D tokens.",
+    )
+    parser_attention.add_argument("--batch-size", type=int, default=1)
+
+    parser_quantize = subparsers.add_parser("quantize", parents=[base_parser])
+    parser_quantize.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+
+    parser_precision = subparsers.add_parser("precision", parents=[base_parser])
+    parser_precision.add_argument(
+        "--dtypes",
+        nargs="+",
+        default=["bfloat16"],
+        choices=["bfloat16", "float16"],
+        help="Dtypes to compare.",
+    )
+    parser_precision.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+
+    parser_compile = subparsers.add_parser("compile", parents=[base_parser])
+    parser_compile.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+    parser_compile.add_argument("--mode", default=None, help="`torch.compile` mode.")
+
+    parser_onnx = subparsers.add_parser("onnx", parents=[base_parser])
+    parser_onnx.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+
+    parser_preprocess = subparsers.add_parser("preprocess", parents=[base_parser])
+    parser_preprocess.add_argument("--n-cameras", type=int, default=2)
+
+    parser_image_size = subparsers.add_parser("image-size", parents=[base_parser])
+    parser_image_size.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+
+    parser_token_reduction = subparsers.add_parser("token-reduction", parents=[base_parser])
+    parser_token_reduction.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+    parser_token_reduction.add_argument(
+        "--pool-strides", type=int, nargs="+", default=[2, 3], help="Pooling strides to benchmark."
+    )
+    parser_token_reduction.add_argument(
+        "--topks", type=int, nargs="+", default=[64, 150], help="Numbers of tokens per camera to keep."
+    )
+
+    parser_stages = subparsers.add_parser("stages", parents=[base_parser])
+    parser_stages.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+    parser_stages.add_argument(
+        "--per-camera", action="store_true", help="Run the backbone once per camera, to time each camera."
+    )
+
+    parser_vision_backbone = subparsers.add_parser("vision-backbone", parents=[base_parser])
+    parser_vision_backbone.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+    parser_vision_backbone.add_argument(
+        "--backbones",
+        nargs="+",
+        default=["resnet18", "regnet_y_400mf", "mobilenet_v3_large", "mobilenet_v3_small", "efficientnet_b0"],
+        help="torchvision backbones to compare.",
+    )
+
+    parser_feature_cache = subparsers.add_parser("feature-cache", parents=[base_parser])
+    parser_feature_cache.add_argument("--batch-size", type=int, default=8)
+
+    parser_activation_checkpointing = subparsers.add_parser("activation-checkpointing", parents=[base_parser])
+    parser_activation_checkpointing.add_argument("--batch-size", type=int, default=8)
+    parser_activation_checkpointing.add_argument(
+        "--max-batch-size", type=int, default=256, help="Largest batch size to try on CUDA."
+    )
+    parser_activation_checkpointing.add_argument(
+        "--memory-budget-gib",
+        type=float,
+        default=16,
+        help="Memory available for training on CPU, to estimate the maximum batch size.",
+    )
+
+    parser_fuse_backbone = subparsers.add_parser("fuse-backbone", parents=[base_parser])
+    parser_fuse_backbone.add_argument("--attention-backend", default="mha", choices=["mha", "sdpa"])
+    parser_fuse_backbone.add_argument("--vision-backbone", default="resnet18", help="torchvision backbone.")
+
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    logging.info(f"Using {torch.get_num_threads()} torch threads.")
+
+    if args.benchmark == "backbone":
+        benchmark_backbone(args)
+    elif args.benchmark == "sinusoidal":
+        benchmark_sinusoidal(args)
+    elif args.benchmark == "inference-checkpoint":
+        benchmark_inference_checkpoint(args)
+    elif args.benchmark == "train-step":
+        benchmark_train_step(args)
+    elif args.benchmark == "select-action":
+        benchmark_select_action(args)
+    elif args.benchmark == "temporal-ensembler":
+        benchmark_temporal_ensembler(args)
+    elif args.benchmark == "attention":
+        benchmark_attention(args)
+    elif args.benchmark == "quantize":
+        benchmark_quantize(args)
+    elif args.benchmark == "precision":
+        benchmark_precision(args)
+    elif args.benchmark == "compile":
+        benchmark_compile(args)
+    elif args.benchmark == "onnx":
+        benchmark_onnx(args)
+    elif args.benchmark == "preprocess":
+        benchmark_preprocess(args)
+    elif args.benchmark == "image-size":
+        benchmark_image_size(args)
+    elif args.benchmark == "token-reduction":
+        benchmark_token_reduction(args)
+    elif args.benchmark == "stages":
+        benchmark_stages(args)
+    elif args.benchmark == "vision-backbone":
+        benchmark_vision_backbone(args)
+    elif args.benchmark == "feature-cache":
+        benchmark_feature_cache(args)
+    elif args.benchmark == "activation-checkpointing":
+        benchmark_activation_checkpointing(args)
+    elif args.benchmark == "fuse-backbone":
+        benchmark_fuse_backbone(args)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare a deployment variant of a trained ACT policy against the original policy on recorded episodes.
+
+For frames sampled from the training dataset's episodes, both policies predict a full action chunk from the
+recorded observation. The script reports the action-space error of the variant against the original policy
+(in the dataset's action units, e.g. motor positions), the error of both against the recorded actions, their
+chunk prediction latency and their model size.
+
+Usage examples:
+
+Dynamic INT8 quantization of the transformer layers, on CPU:
+```
+python lerobot/scripts/eval_act_offline.py quantize \
+    -p outputs/train/act_moss_real/checkpoints/080000/pretrained_model \
+    --n-episodes 5 --frame-stride 10
+```
+
+Also quantize the vision backbone's convolutions:
+```
+python lerobot/scripts/eval_act_offline.py quantize -p ... --quantize-backbone
+```
+
+Reduced precision inference (bfloat16 on CPU, float16 on GPU), or a per-submodule precision:
+```
+python lerobot/scripts/eval_act_offline.py precision -p ... --device cuda
+python lerobot/scripts/eval_act_offline.py precision -p ... --backbone bfloat16 --encoder bfloat16
+```
+
+ONNX Runtime inference of the exported inference graph (see `export_act.py onnx`), exported on the fly unless
+`--onnx-path` is given:
+```
+python lerobot/scripts/eval_act_offline.py onnx -p ... --num-threads 4
+```
+
+Another checkpoint trained on the same dataset, for instance with downscaled or cropped images (see
+`image_resize_shapes` and `image_crops` in `ACTConfig`). Its error to the recorded actions is the accuracy
+to compare with the reference's:
+```
+python lerobot/scripts/eval_act_offline.py checkpoint -p ... \
+    -c outputs/train/act_moss_real_240x320/checkpoints/080000/pretrained_model
+```
+
+Early exit from the transformer decoder (see `decoder_exit_layer` in `ACTConfig`): compare the policy running
+only its first 1, 2, ... decoder layers against the full decoder, to pick the cheapest depth whose error to
+the recorded actions is still on par:
+```
+python lerobot/scripts/eval_act_offline.py decoder-depth -p ... --exit-layers 1 2 4
+```
+
+Frozen batch norms of the vision backbone folded into its convolutions, with the backbone in the channels
+last memory format (see `make_fused_backbone_policy`), to check that the actions match up to float rounding:
+```
+python lerobot/scripts/eval_act_offline.py fuse-backbone -p ...
+python lerobot/scripts/eval_act_offline.py fuse-backbone -p ... --no-channels-last
+```
+
+Any trailing key=value arguments override the config values used to make the dataset (e.g.
+`dataset_repo_id=...`).
+"""
+
+import argparse
+import copy
+import io
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import Tensor, nn
+
+from lerobot.common.datasets.factory import make_dataset
+from lerobot.common.policies.act.inference_act import (
+    PRECISION_DTYPES,
+    PRECISION_SUBMODULES,
+    make_example_observation,
+    make_fused_backbone_policy,
+    make_mixed_precision_policy,
+    quantize_dynamic_int8,
+)
+from lerobot.common.policies.act.modeling_act import ACTPolicy
+from lerobot.common.policies.act.onnx_act import ACTOnnxRuntimeBackend, export_onnx
+from lerobot.common.policies.factory import make_policy
+from lerobot.common.utils.utils import init_hydra_config, init_logging
+from lerobot.scripts.eval import get_pretrained_policy_path
+
+
+def model_size_bytes(module: nn.Module) -> int:
+    """Size of the serialized state dict of `module` (this also covers quantized packed weights)."""
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def select_frames(dataset, n_episodes: int | None, frame_stride: int) -> list[int]:
+    """Indices of every `frame_stride`-th frame of the first `n_episodes` episodes of `dataset`."""
+    episode_data_index = dataset.episode_data_index
+    n_episodes = len(episode_data_index["from"]) if n_episodes is None else n_episodes
+    indices = []
+    for from_idx, to_idx in zip(
+        episode_data_index["from"][:n_episodes], episode_data_index["to"][:n_episodes], strict=True
+    ):
+        indices.extend(range(from_idx.item(), to_idx.item(), frame_stride))
+    return indices
+
+
+def make_batch(item: dict, device: torch.device) -> dict[str, Tensor]:
+    """Add a batch dimension to the tensors of a dataset item, and move them to `device`."""
+    return {k: v.unsqueeze(0).to(device) for k, v in item.items() if isinstance(v, Tensor)}
+
+
+def compare_policies(
+    reference: ACTPolicy,
+    candidate: ACTPolicy,
+    dataset,
+    frame_indices: list[int],
+    reference_device: torch.device,
+    candidate_device: torch.device,
+) -> dict:
+    """Compare the action chunks predicted by `candidate` and `reference` on the given dataset frames.
+
+    Errors are in the (unnormalized) action space. "first_action" errors only look at the first action of each
+    chunk, which is the one executed straight away.
+    """
+    errors = []
+    reference_errors_to_recorded = []
+    candidate_errors_to_recorded = []
+    latencies_s = {"reference": [], "candidate": []}
+    for idx in frame_indices:
+        item = dataset[idx]
+        actions = {}
+        for name, policy, device in [
+            ("reference", reference, reference_device),
+            ("candidate", candidate, candidate_device),
+        ]:
+            batch = make_batch(item, device)
+            start = time.perf_counter()
+            actions[name] = policy.predict_action_chunk(batch)[0].to("cpu", torch.float32)
+            latencies_s[name].append(time.perf_counter() - start)
+        errors.append((actions["candidate"] - actions["reference"]).abs())
+        if "action" in item:
+            is_valid = ~item["action_is_pad"] if "action_is_pad" in item else slice(None)
+            recorded = item["action"][is_valid]
+            n = len(recorded)
+            reference_errors_to_recorded.append((actions["reference"][:n] - recorded).abs())
+            candidate_errors_to_recorded.append((actions["candidate"][:n] - recorded).abs())
+
+    errors = torch.stack(errors)  # (n_frames, chunk_size, action_dim)
+    info = {
+        "n_frames": len(frame_indices),
+        "max_abs_error": errors.max().item(),
+        "mean_abs_error": errors.mean().item(),
+        "p99_abs_error": torch.quantile(errors.flatten(), 0.99).item(),
+        "first_action_max_abs_error": errors[:, 0].max().item(),
+        "first_action_mean_abs_error": errors[:, 0].mean().item(),
+        "max_abs_error_per_action_dim": errors.amax(dim=(0, 1)).tolist(),
+    }
+    if len(reference_errors_to_recorded) > 0:
+        info["reference_l1_to_recorded"] = torch.cat(reference_errors_to_recorded).mean().item()
+        info["candidate_l1_to_recorded"] = torch.cat(candidate_errors_to_recorded).mean().item()
+    for name, latencies in latencies_s.items():
+        # Skip the first call, which includes one-off initialization costs.
+        latencies_ms = np.array(latencies[1:] or latencies) * 1000
+        info[f"{name}_p50_ms"] = float(np.percentile(latencies_ms, 50))
+        info[f"{name}_p95_ms"] = float(np.percentile(latencies_ms, 95))
+    info["reference_size_MiB"] = model_size_bytes(reference) / 2**20
+    info["candidate_size_MiB"] = model_size_bytes(candidate) / 2**20
+    return info
+
+
+def make_candidate(args, reference: ACTPolicy) -> tuple[ACTPolicy, torch.device]:
+    """Make the policy variant to compare against `reference`, and the device it runs on."""
+    if args.variant == "quantize":
+        return quantize_dynamic_int8(reference, quantize_backbone=args.quantize_backbone), torch.device("cpu")
+    if args.variant == "precision":
+        precision = {k: getattr(args, k) for k in PRECISION_SUBMODULES if getattr(args, k) is not None}
+        return make_mixed_precision_policy(reference, precision or None), torch.device(args.device)
+    if args.variant == "onnx":
+        if args.onnx_path is None:
+            args.onnx_path = Path(tempfile.mkdtemp()) / "model.onnx"
+            export_onnx(
+                reference, args.onnx_path, make_example_observation(reference.config, device=args.device)
+            )
+        candidate = copy.deepcopy(reference)
+        candidate.set_inference_backend(ACTOnnxRuntimeBackend(args.onnx_path, num_threads=args.num_threads))
+        return candidate, torch.device(args.device)
+    if args.variant == "decoder-depth":
+        # The reference runs the full decoder, and the candidate's exit layer is set per comparison.
+        candidate = copy.deepcopy(reference)
+        reference.config.decoder_exit_layer = None
+        return candidate, torch.device(args.device)
+    if args.variant == "fuse-backbone":
+        candidate = make_fused_backbone_policy(reference, channels_last=args.channels_last)
+        return candidate, torch.device(args.device)
+    if args.variant == "checkpoint":
+        candidate_path = get_pretrained_policy_path(args.candidate_policy_name_or_path)
+        hydra_cfg = init_hydra_config(str(candidate_path / "config.yaml"), args.overrides)
+        candidate = make_policy(hydra_cfg=hydra_cfg, pretrained_policy_name_or_path=str(candidate_path))
+        return candidate.to(args.device).eval(), torch.device(args.device)
+    raise ValueError(args.variant)
+
+
+def compare_decoder_depths(
+    args,
+    reference: ACTPolicy,
+    candidate: ACTPolicy,
+    dataset,
+    frame_indices: list[int],
+    device: torch.device,
+) -> dict:
+    """Compare `candidate` exiting the decoder after each of `args.exit_layers` layers against `reference`."""
+    n_decoder_layers = reference.config.n_decoder_layers
+    info = {}
+    for exit_layer in args.exit_layers or range(1, n_decoder_layers + 1):
+        if not 1 <= exit_layer <= n_decoder_layers:
+            raise ValueError(f"Exit layers must be between 1 and {n_decoder_layers}. Got {exit_layer}.")
+        candidate.config.decoder_exit_layer = exit_layer
+        info[exit_layer] = compare_policies(reference, candidate, dataset, frame_indices, device, device)
+        logging.info(
+            f"Exit after {exit_layer}/{n_decoder_layers} decoder layers: "
+            f"p50 {info[exit_layer]['candidate_p50_ms']:.2f} ms "
+            f"(full decoder {info[exit_layer]['reference_p50_ms']:.2f} ms), "
+            f"mean abs error to the full decoder {info[exit_layer]['mean_abs_error']:.4f}, "
+            f"L1 to recorded {info[exit_layer].get('candidate_l1_to_recorded', float('nan')):.4f} "
+            f"(full decoder {info[exit_layer].get('reference_l1_to_recorded', float('nan')):.4f})."
+        )
+    return {f"exit_layer_{exit_layer}": exit_info for exit_layer, exit_info in info.items()}
+
+
+def main(args):
+    pretrained_policy_path = get_pretrained_policy_path(args.pretrained_policy_name_or_path, args.revision)
+    hydra_cfg = init_hydra_config(str(pretrained_policy_path / "config.yaml"), args.overrides)
+
+    device = torch.device(args.device)
+    if args.variant == "quantize" and device.type != "cpu":
+        raise ValueError(
+            "Quantized policies run on CPU, so the reference policy must too. Use `--device cpu`."
+        )
+
+    logging.info("Making dataset.")
+    dataset = make_dataset(hydra_cfg)
+    frame_indices = select_frames(dataset, args.n_episodes, args.frame_stride)
+
+    logging.info("Making policies.")
+    reference = make_policy(hydra_cfg=hydra_cfg, pretrained_policy_name_or_path=str(pretrained_policy_path))
+    reference.to(device).eval()
+    candidate, candidate_device = make_candidate(args, reference)
+
+    logging.info(f"Comparing the policies on {len(frame_indices)} frames.")
+    if args.variant == "decoder-depth":
+        info = compare_decoder_depths(args, reference, candidate, dataset, frame_indices, device)
+    else:
+        info = compare_policies(reference, candidate, dataset, frame_indices, device, candidate_device)
+    if args.variant == "onnx":
+        # The candidate's torch weights are unused, report the size of the ONNX graph instead.
+        info["candidate_size_MiB"] = (
+            sum(p.stat().st_size for p in args.onnx_path.parent.glob(f"{args.onnx_path.name}*")) / 2**20
+        )
+    for key, value in info.items():
+        logging.info(f"{key}: {value}")
+
+    if args.out_file is not None:
+        args.out_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out_file, "w") as f:
+            json.dump(info, f, indent=2)
+
+
+if __name__ == "__main__":
+    init_logging()
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="variant", required=True)
+
+    # Set common options for all the subparsers
+    base_parser = argparse.ArgumentParser(add_help=False)
+    base_parser.add_argument(
+        "-p",
+        "--pretrained-policy-name-or-path",
+        required=True,
+        help=(
+            "Either the repo ID of a model hosted on the Hub or a path to a directory containing weights "
+            "saved using `Policy.save_pretrained`."
+        ),
+    )
+    base_parser.add_argument("--revision", help="Optionally provide the Hugging Face Hub revision ID.")
+    base_parser.add_argument("--device", default="cpu", help="Device to run the reference policy on.")
+    base_parser.add_argument(
+        "--n-episodes",
+        type=int,
+        default=None,
+        help="Number of episodes to sample frames from (default: all).",
+    )
+    base_parser.add_argument(
+        "--frame-stride", type=int, default=10, help="Only evaluate every `frame-stride`-th frame."
+    )
+    base_parser.add_argument("--out-file", type=Path, help="Optional json file to write the results to.")
+    base_parser.add_argument(
+        "overrides",
+        nargs="*",
+        help="Any key=value arguments to override config values (use dots for.nested=overrides)",
+    )
+
+    parser_quantize = subparsers.add_parser("quantize", parents=[base_parser])
+    parser_quantize.add_argument(
+        "--quantize-backbone",
+        action="store_true",
+        help="Also apply dynamic INT8 quantization to the vision backbone's convolutions.",
+    )
+
+    parser_precision = subparsers.add_parser("precision", parents=[base_parser])
+    for submodule in PRECISION_SUBMODULES:
+        parser_precision.add_argument(
+            f"--{submodule}",
+            choices=list(PRECISION_DTYPES),
+            help=(
+                f"Precision of the {submodule}. If none of the submodules' precision is given, they all run "
+                "in bfloat16 on CPU and float16 on other devices."
+            ),
+        )
+
+    parser_onnx = subparsers.add_parser("onnx", parents=[base_parser])
+    parser_onnx.add_argument(
+        "--onnx-path",
+        type=Path,
+        help="Exported ONNX graph of the policy (default: export the policy to a temporary directory).",
+    )
+    parser_onnx.add_argument(
+        "--num-threads", type=int, help="Number of intra-op threads used by ONNX Runtime (default: all)."
+    )
+
+    parser_checkpoint = subparsers.add_parser("checkpoint", parents=[base_parser])
+    parser_checkpoint.add_argument(
+        "-c",
+        "--candidate-policy-name-or-path",
+        required=True,
+        help="Repo ID or path of the policy to compare against the one given with `-p`.",
+    )
+
+    parser_decoder_depth = subparsers.add_parser("decoder-depth", parents=[base_parser])
+    parser_decoder_depth.add_argument(
+        "--exit-layers",
+        type=int,
+        nargs="+",
+        help="Numbers of decoder layers to exit after (default: 1 to `n_decoder_layers`).",
+    )
+
+    parser_fuse_backbone = subparsers.add_parser("fuse-backbone", parents=[base_parser])
+    parser_fuse_backbone.add_argument(
+        "--no-channels-last",
+        dest="channels_last",
+        action="store_false",
+        help="Keep the backbone in the default (NCHW) memory format.",
+    )
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Export a trained ACT policy for deployment.
+
+Usage examples:
+
+Write an inference-only checkpoint (without the VAE encoder, which is only used for training):
+```
+python lerobot/scripts/export_act.py inference \
+    -p outputs/train/act_moss_real/checkpoints/080000/pretrained_model \
+    -o outputs/export/act_moss_real_inference
+```
+
+The exported directory can be used anywhere a `pretrained_model` directory is expected (for instance with
+`control_robot.py record -p ...`), or loaded with
+`lerobot.common.policies.act.inference_act.load_inference_policy`.
+
+Also export the inference graph to ONNX (`model.onnx` in the output directory), and check it against the
+torch model on random observations:
+```
+python lerobot/scripts/export_act.py onnx -p ... -o outputs/export/act_moss_real_onnx
+```
+
+Run it with ONNX Runtime via `lerobot.common.policies.act.onnx_act.ACTOnnxRuntimeBackend`.
+"""
+
+import argparse
+import copy
+import logging
+import time
+from pathlib import Path
+
+import torch
+from omegaconf import OmegaConf
+
+from lerobot.common.policies.act.inference_act import (
+    export_inference_checkpoint,
+    load_inference_policy,
+    make_example_observation,
+)
+from lerobot.common.policies.act.modeling_act import ACTPolicy
+from lerobot.common.policies.act.onnx_act import ACTOnnxRuntimeBackend, export_onnx
+from lerobot.common.utils.utils import format_big_number, init_logging
+from lerobot.scripts.eval import get_pretrained_policy_path
+
+
+def export_inference(pretrained_policy_path: Path, out_dir: Path):
+    policy = ACTPolicy.from_pretrained(pretrained_policy_path)
+    inference_policy = export_inference_checkpoint(policy, out_dir)
+
+    # Also write the hydra config used by `make_policy`, so that the exported directory is a drop-in
+    # replacement for the original one.
+    if (pretrained_policy_path / "config.yaml").exists():
+        hydra_cfg = OmegaConf.load(pretrained_policy_path / "config.yaml")
+        hydra_cfg.policy.inference_only = True
+        hydra_cfg.policy.pretrained_backbone_weights = None
+        OmegaConf.save(hydra_cfg, out_dir / "config.yaml")
+
+    num_params = sum(p.numel() for p in policy.parameters())
+    num_inference_params = sum(p.numel() for p in inference_policy.parameters())
+    size_mb = (pretrained_policy_path / "model.safetensors").stat().st_size / 2**20
+    inference_size_mb = (out_dir / "model.safetensors").stat().st_size / 2**20
+    logging.info(f"{num_params=} ({format_big_number(num_params)})")
+    logging.info(f"{num_inference_params=} ({format_big_number(num_inference_params)})")
+    logging.info(f"model.safetensors: {size_mb:.1f} MiB -> {inference_size_mb:.1f} MiB")
+
+    start = time.perf_counter()
+    ACTPolicy.from_pretrained(pretrained_policy_path)
+    load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    load_inference_policy(out_dir)
+    inference_load_s = time.perf_counter() - start
+    logging.info(f"Load time: {load_s:.2f}s -> {inference_load_s:.2f}s")
+    logging.info(f"Exported inference-only policy to {out_dir}")
+
+
+def export_onnx_graph(out_dir: Path, n_parity_checks: int = 10):
+    """Export the inference graph of the inference-only policy in `out_dir` to `out_dir / "model.onnx"`."""
+    policy = load_inference_policy(out_dir)
+    onnx_path = out_dir / "model.onnx"
+    input_names = export_onnx(policy, onnx_path, make_example_observation(policy.config))
+    logging.info(f"Exported the inference graph with inputs {input_names} to {onnx_path}")
+
+    onnx_policy = copy.deepcopy(policy)
+    onnx_policy.set_inference_backend(ACTOnnxRuntimeBackend(onnx_path))
+    max_abs_error = 0.0
+    for _ in range(n_parity_checks):
+        observation = make_example_observation(policy.config)
+        for key in observation:
+            observation[key] = torch.rand_like(observation[key])
+        actions = policy.predict_action_chunk(observation)
+        onnx_actions = onnx_policy.predict_action_chunk(observation)
+        max_abs_error = max(max_abs_error, (onnx_actions - actions).abs().max().item())
+    logging.info(
+        f"Max absolute action error of ONNX Runtime vs torch on random observations: {max_abs_error}"
+    )
+
+
+if __name__ == "__main__":
+    init_logging()
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="format", required=True)
+
+    # Set common options for all the subparsers
+    base_parser = argparse.ArgumentParser(add_help=False)
+    base_parser.add_argument(
+        "-p",
+        "--pretrained-policy-name-or-path",
+        required=True,
+        help=(
+            "Either the repo ID of a model hosted on the Hub or a path to a directory containing weights "
+            "saved using `Policy.save_pretrained`."
+        ),
+    )
+    base_parser.add_argument("--revision", help="Optionally provide the Hugging Face Hub revision ID.")
+    base_parser.add_argument(
+        "-o", "--out-dir", type=Path, required=True, help="Directory to write the exported policy to."
+    )
+
+    subparsers.add_parser("inference", parents=[base_parser])
+    subparsers.add_parser("onnx", parents=[base_parser])
+
+    args = parser.parse_args()
+
+    pretrained_policy_path = get_pretrained_policy_path(
+        args.pretrained_policy_name_or_path, revision=args.revision
+    )
+
+    if args.format in ["inference", "onnx"]:
+        export_inference(pretrained_policy_path, args.out_dir)
+    if args.format == "onnx":
+        export_onnx_graph(args.out_dir)
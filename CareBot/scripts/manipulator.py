@@ -591,21 +591,23 @@ class ManipulatorRobot:
             obs_dict[f"observation.images.{name}"] = images[name]
         return obs_dict
 
-    def send_action(self, action: torch.Tensor) -> torch.Tensor:
+    def send_action(self, action: torch.Tensor | np.ndarray) -> torch.Tensor | np.ndarray:
         """Command the follower arms to move to a target joint configuration.
 
         The relative action magnitude may be clipped depending on the configuration parameter
         `max_relative_target`. In this case, the action sent differs from original action.
-        Thus, this function always returns the action actually sent.
+        Thus, this function always returns the action actually sent, with the same type as `action`.
 
         Args:
-            action: tensor containing the concatenated goal positions for the follower arms.
+            action: tensor or numpy array (e.g. from `policy.select_action(..., return_numpy=True)`)
+                containing the concatenated goal positions for the follower arms.
         """
         if not self.is_connected:
             raise RobotDeviceNotConnectedError(
                 "ManipulatorRobot is not connected. You need to run `robot.connect()`."
             )
 
+        is_numpy = isinstance(action, np.ndarray)
         from_idx = 0
         to_idx = 0
         action_sent = []
@@ -620,16 +622,20 @@ class ManipulatorRobot:
             if self.config.max_relative_target is not None:
                 present_pos = self.follower_arms[name].read("Present_Position")
                 present_pos = torch.from_numpy(present_pos)
-                goal_pos = ensure_safe_goal_position(goal_pos, present_pos, self.config.max_relative_target)
+                goal_pos = ensure_safe_goal_position(
+                    torch.as_tensor(goal_pos), present_pos, self.config.max_relative_target
+                )
+                if is_numpy:
+                    goal_pos = goal_pos.numpy()
 
             # Save tensor to concat and return
             action_sent.append(goal_pos)
 
             # Send goal position to each follower
-            goal_pos = goal_pos.numpy().astype(np.int32)
+            goal_pos = (goal_pos if is_numpy else goal_pos.numpy()).astype(np.int32)
             self.follower_arms[name].write("Goal_Position", goal_pos)
 
-        return torch.cat(action_sent)
+        return np.concatenate(action_sent) if is_numpy else torch.cat(action_sent)
 
     def print_logs(self):
         pass
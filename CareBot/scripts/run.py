@@ -1,10 +1,17 @@
-from lerobot.common.policies.act.modeling_act_try import ACTPolicy
+from lerobot.common.policies.act.modeling_act import ACTPolicy
+from lerobot.common.policies.act.inference_act import (
+    ACTCompiledEngine,
+    ACTObservationPreprocessor,
+    make_example_observation,
+    make_fused_backbone_policy,
+    make_mixed_precision_policy,
+)
+from lerobot.common.policies.act.onnx_act import ACTOnnxRuntimeBackend
 import time
 from lerobot.scripts.control_robot import busy_wait
 from lerobot.common.robot_devices.robots.manipulator import ManipulatorRobot
 from lerobot.common.robot_devices.motors.feetech import FeetechMotorsBus 
 from lerobot.common.robot_devices.cameras.opencv import OpenCVCamera
-import torch 
 import os
 import platform
 
@@ -78,35 +85,59 @@ def say(text, blocking=False):
 inference_time_s = 120
 fps = 30
 device = "mps"  # TODO: On Mac, use "mps" or "cpu"
+# Reduced precision inference: None (float32), "bfloat16", "float16", or a per-submodule map such as
+# {"backbone": "bfloat16", "encoder": "bfloat16"}. Check the action drift with eval_act_offline.py first.
+inference_precision = None
+# Fold the backbone's frozen batch norms into its convolutions and run it in the channels last memory format.
+# Same actions up to float rounding, see `eval_act_offline.py fuse-backbone` and
+# `benchmark_act.py fuse-backbone`.
+fuse_backbone = False
+# Compile the model for the robot's fixed input shapes at startup. This takes a while, see
+# `benchmark_act.py compile` to decide whether it's worth it on this machine.
+compile_policy = False
+# Run the model with ONNX Runtime instead of torch, from a graph exported with `export_act.py onnx` (e.g.
+# f"{ckpt_path}/model.onnx"). Check the action error with `eval_act_offline.py onnx` first.
+onnx_path = None
 
 ckpt_path = "/Users/dharunish/Desktop/Robotics/trained_models/feeding_task_all_8ah_32model/pretrained_model"
 # ckpt_path = "/Users/helper2424/Documents/lerobot/outputs/koch_move_obj_static_cameras/model.safetensors"
 policy = ACTPolicy.from_pretrained(ckpt_path, force_download=True)
 policy.to(device)
+if fuse_backbone:
+    policy = make_fused_backbone_policy(policy)
+if inference_precision is not None:
+    policy = make_mixed_precision_policy(policy, inference_precision)
+if compile_policy:
+    policy.set_inference_backend(
+        ACTCompiledEngine(policy, make_example_observation(policy.config, device=device))
+    )
+if onnx_path is not None:
+    policy.set_inference_backend(ACTOnnxRuntimeBackend(onnx_path))
+preprocess = ACTObservationPreprocessor(policy)
+
+robot.connect()
 
 say("I am going to collect objects")
-for _ in range(inference_time_s * fps):
+for step in range(inference_time_s * fps):
     start_time = time.perf_counter()
 
     # Read the follower state and access the frames from the cameras
     observation = robot.capture_observation()
+    if policy.config.time_embed:
+        # The policy is conditioned on the index of the frame in the episode, which starts with this loop. It
+        # was trained on episodes shorter than `max_ep_time` frames, so hold the index at the last one of them
+        # rather than extrapolating past it when the loop runs longer.
+        observation["frame_index"] = min(step, policy.config.max_ep_time - 1)
 
-    # Convert to pytorch format: channel first and float32 in [0,1]
-    # with batch dimension
-    for name in observation:
-        if "image" in name:
-            observation[name] = observation[name].type(torch.float32) / 255
-            observation[name] = observation[name].permute(2, 0, 1).contiguous()
-        observation[name] = observation[name].unsqueeze(0)
-        observation[name] = observation[name].to(device)
+    # Convert the uint8 frames and the state to the normalized model inputs, with a batch dimension and the
+    # cameras stacked, in one pass
+    inputs = preprocess(observation)
 
     # Compute the next action with the policy
-    # based on the current observation
-    action = policy.select_action(observation)
+    # based on the current observation, as a numpy array on cpu
+    action = policy.select_action(inputs, preprocessed=True, return_numpy=True)
     # Remove batch dimension
     action = action.squeeze(0)
-    # Move to cpu, if not already the case
-    action = action.to("cpu")
     # Order the robot to move
     robot.send_action(action)
 
@@ -48,7 +48,7 @@ from lerobot.common.utils.utils import (
     init_logging,
     set_global_seed,
 )
-from lerobot.scripts.eval import eval_policy
+from lerobot.scripts.eval import eval_policy, get_pretrained_policy_path
 
 
 def make_optimizer_and_scheduler(cfg, policy):
@@ -392,6 +392,53 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
             )
             logging.info("Resume training")
 
+    teacher = None
+    if cfg.training.get("distillation_teacher_path"):
+        # Distill a trained ACT policy (the teacher) into this one: the policy is trained on the teacher's
+        # predicted action chunks as well as on the recorded actions (see `distillation_loss_weight`).
+        if cfg.policy.name != "act":
+            raise NotImplementedError("Distillation is only implemented for ACT.")
+        if cfg.training.online_steps > 0 or cfg.training.get("image_feature_cache_dir"):
+            raise NotImplementedError(
+                "Distillation is only implemented for offline training on the camera images."
+            )
+        teacher_path = get_pretrained_policy_path(cfg.training.distillation_teacher_path)
+        logging.info("make_policy (distillation teacher)")
+        teacher = make_policy(
+            hydra_cfg=init_hydra_config(str(teacher_path / "config.yaml")),
+            pretrained_policy_name_or_path=str(teacher_path),
+        )
+        teacher.to(device).eval().requires_grad_(False)
+        if teacher.config.chunk_size < policy.config.chunk_size:
+            raise ValueError(
+                f"The teacher's chunk size ({teacher.config.chunk_size}) must be at least the policy's "
+                f"({policy.config.chunk_size})."
+            )
+
+    if cfg.training.get("image_feature_cache_dir"):
+        # Train on the feature maps of the frozen vision backbone, computed once for the whole dataset,
+        # instead of decoding the camera frames and running the backbone at every step.
+        if cfg.policy.name != "act":
+            raise NotImplementedError("The image feature cache is only implemented for ACT.")
+        if cfg.training.online_steps > 0 or isinstance(offline_dataset, MultiLeRobotDataset):
+            raise NotImplementedError(
+                "The image feature cache is only implemented for offline training on a single dataset."
+            )
+        from lerobot.common.policies.act.feature_cache_act import (
+            ACTImageFeatureDataset,
+            build_image_feature_cache,
+        )
+
+        logging.info("build_image_feature_cache")
+        cache_dir = build_image_feature_cache(
+            policy,
+            offline_dataset,
+            cfg.training.image_feature_cache_dir,
+            batch_size=cfg.training.batch_size,
+            num_workers=cfg.training.num_workers,
+        )
+        offline_dataset = ACTImageFeatureDataset(offline_dataset, cache_dir)
+
     # create dataloader for offline training
     if cfg.training.get("drop_n_last_frames"):
         shuffle = False
@@ -427,6 +474,13 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
         for key in batch:
             batch[key] = batch[key].to(device, non_blocking=True)
 
+        if teacher is not None:
+            start_time = time.perf_counter()
+            with torch.autocast(device_type=device.type) if cfg.use_amp else nullcontext():
+                teacher_action = teacher.predict_action_chunk(batch)
+            batch["teacher_action"] = teacher_action[:, : policy.config.chunk_size].float()
+            teacher_s = time.perf_counter() - start_time
+
         train_info = update_policy(
             policy,
             batch,
@@ -438,6 +492,8 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
         )
 
         train_info["dataloading_s"] = dataloading_s
+        if teacher is not None:
+            train_info["teacher_s"] = teacher_s
 
         if step % cfg.training.log_freq == 0:
             log_train_info(logger, train_info, step, cfg, offline_dataset, is_online=False)